@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
+
+import codecs
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NdjsonParser(BaseParser):
+    """Newline delimited JSON (one JSON value per line) -> list, read line by line from the request stream"""
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        items = []
+        try:
+            for line_no, line in enumerate(codecs.getreader(encoding)(stream), start=1):
+                line = line.strip()
+                if line:
+                    items.append(json.loads(line))
+        except ValueError as e:
+            raise ParseError(f'NDJSON parse error on line {line_no} - {e}')
+        return items
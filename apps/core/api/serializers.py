@@ -2,4 +2,28 @@
 
 __author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
 
+from django.conf import settings
 from rest_framework import serializers
+
+
+class DecodedTextField(serializers.Field):
+    """Batch item: raw UPN text or {"decodedText": "..."} like the HTMX scan form posts"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, dict):
+            data = data.get('decodedText')
+        if not isinstance(data, str) or not data:
+            raise serializers.ValidationError('Expected UPN text or object with decodedText')
+        return data
+
+    def to_representation(self, value):
+        return value
+
+
+class UpnBatchSerializer(serializers.Serializer):
+    items = serializers.ListField(child=DecodedTextField(), allow_empty=False)
+
+    def validate_items(self, value):
+        if len(value) > settings.QR_BATCH_MAX_ITEMS:
+            raise serializers.ValidationError(f'Max {settings.QR_BATCH_MAX_ITEMS} items per batch')
+        return value
@@ -17,3 +17,43 @@ import time
 import re
 from pathlib import Path
 from django.db.models import Value, BooleanField
+from django.urls import reverse
+from rest_framework.parsers import JSONParser
+from result import is_err
+
+from apps.core.api.parsers import NdjsonParser
+from apps.core.api.serializers import UpnBatchSerializer
+from apps.qr.services import create_upn_models_bulk
+
+
+class UpnBatchConvertView(APIView):
+    """
+    Batch UPN -> EPC conversion.
+    Body: JSON array (or NDJSON, one item per line) of raw UPN texts or {"decodedText": "..."} objects.
+    ?image=1 adds absolute QR image URL to every converted item.
+    """
+    parser_classes = [JSONParser, NdjsonParser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = UpnBatchSerializer(data={'items': request.data})
+        serializer.is_valid(raise_exception=True)
+        with_image = request.query_params.get('image') == '1'
+
+        results = []
+        for index, result in enumerate(create_upn_models_bulk(serializer.validated_data['items'])):
+            if is_err(result):
+                results.append({'index': index, 'ok': False, 'error': result.err_value})
+                continue
+            upn_model = result.value['model']
+            item = {'index': index, 'ok': True, 'rnd': upn_model.rnd, 'created': result.value['created'],
+                    'epc': result.value['epc']}
+            if with_image:
+                item['image'] = request.build_absolute_uri(
+                    f'{reverse("qr_image", args=[upn_model.rnd])}?v={upn_model.md5}')
+            results.append(item)
+
+        return Response({
+            'count': len(results),
+            'errors': sum(1 for r in results if not r['ok']),
+            'results': results,
+        })
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+from datetime import date, timedelta
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.utils import timezone
+from result import is_err
+
+from apps.qr.codec import UpnPayload, encode_upn
+from apps.qr.epc import generate_qr_code, render_cache
+from apps.qr.models import UpnModel, md5_hash
+from apps.qr.pdf_generator import UpnPdfGenerator
+from apps.qr.records import EpcRecord, PdfRecord
+from apps.qr.services import create_upn_model, parse_upn_text
+from apps.qr.upn import UpnBaseModel
+from apps.qr.views import scan_cache
+
+FIRST_NAMES = ('Janez', 'Marija', 'Franc', 'Ana', 'Ivan', 'Mojca', 'Špela', 'Žiga', 'Čedomir', 'Đurđica', 'Matjaž')
+LAST_NAMES = ('Novak', 'Horvat', 'Kovačič', 'Krajnc', 'Zupančič', 'Potočnik', 'Čebulj-Koželj', 'Šuštaršič',
+              'Mašera-Spasić', 'Žagar', 'Đorđević')
+STREETS = ('Slovenska cesta', 'Povšetova ulica', 'Cesta v Šmartno', 'Ulica bratov Učakar', 'Trg francoske revolucije',
+           'Mašera-Spasićeva ulica', 'Žabjak', 'Čopova ulica')
+POSTS = ('1000 Ljubljana', '2000 Maribor', '3000 Celje', '4000 Kranj', '5000 Nova Gorica', '6000 Koper - Capodistria',
+         '8000 Novo mesto', '9000 Murska Sobota')
+RECIPIENTS = ('Snaga d.o.o.', 'Elektro Ljubljana d.d.', 'Telekom Slovenije d.d.', 'JP VOKA SNAGA d.o.o.',
+              'Petrol d.d., Ljubljana', 'Zavod za zdravstveno zavarovanje', 'Občina Šmarje pri Jelšah',
+              'Komunalno podjetje Ptuj d.d.')
+PURPOSE_CODES = ('OTHR', 'GDSV', 'SCVE', 'ELEC', 'WTER', 'PHON', 'INSU', 'TAXS', '')
+PURPOSES = ('Ravn. z odpadki', 'Električna energija', 'Storitve mobilne telefonije', 'Oskrba s pitno vodo',
+            'Zavarovalna premija', 'Nadomestilo za uporabo stavbnega zemljišča', 'Članarina')
+
+
+def synthetic_upn_payloads(count: int, seed: int) -> list:
+    """
+    Deterministic realistic UPN slips: diacritics, names and addresses at the 33 character field limit,
+    zero amounts (fill-in slips), with and without deadline and purpose code
+    """
+    rng = random.Random(seed)
+    payloads = []
+    for n in range(count):
+        name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+        if n % 5 == 0:
+            name = f'{name} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}'
+        amount = 0.0 if n % 7 == 0 else round(rng.choice((rng.uniform(0.01, 100), rng.uniform(100, 99999))), 2)
+        deadline = date(2026, 1, 1) + timedelta(days=rng.randrange(365)) if n % 4 else None
+        payloads.append(UpnPayload(
+            ime_placnika=name[:33], ulica_placnika=f'{rng.choice(STREETS)} {rng.randrange(1, 200)}'[:33],
+            kraj_placnika=rng.choice(POSTS), znesek=amount, koda_namena=rng.choice(PURPOSE_CODES),
+            namen_placila=f'{rng.choice(PURPOSES)} {rng.randrange(1, 13):02d}/2026 {n:010d}'[:42],
+            rok_placila=deadline, iban_prejemnika=f'SI56{rng.randrange(10 ** 15):015d}',
+            referenca=f'SI{rng.choice(("00", "12", "99"))}{rng.randrange(10 ** 12):d}'[:26],
+            ime_prejemnika=rng.choice(RECIPIENTS), ulica_prejemnika=f'{rng.choice(STREETS)} {rng.randrange(1, 60)}',
+            kraj_prejemnika=rng.choice(POSTS)))
+    return payloads
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+class Command(BaseCommand):
+    help = ('Benchmark suite: UPN parse, content hash, create/dedupe, QR and PDF render and the views, '
+            'on a synthetic dataset. --output writes JSON, --compare flags regressions against a saved run. '
+            'All rows are written in one transaction which is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=100, help='Dataset size = timed calls per case')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--filter', nargs='*', default=[], help='Only cases whose name contains any of these')
+        parser.add_argument('--output', help='Write results as JSON to this file')
+        parser.add_argument('--compare', help='JSON of an earlier run, median slower by --threshold is a regression')
+        parser.add_argument('--threshold', type=float, default=0.10, help='Allowed slowdown, 0.10 = 10%%')
+
+    def handle(self, *args, **options):
+        payloads = synthetic_upn_payloads(options['records'], options['seed'])
+        # Without the final LF, as the scanner page posts decodedText
+        texts = [encode_upn(payload).rstrip('\n') for payload in payloads]
+        results = {}
+        # View cases go through the test client (Host: testserver), the configured ALLOWED_HOSTS may not have it
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name, calls in self.cases(texts):
+                if options['filter'] and not any(part in name for part in options['filter']):
+                    continue
+                results[name] = self.time_calls(calls)
+                self.stdout.write(f'{name:<28} {results[name]["median_ms"]:>9.3f} ms median '
+                                  f'{results[name]["p95_ms"]:>9.3f} ms p95')
+            transaction.set_rollback(True)
+        render_cache.clear()
+        scan_cache.clear()
+
+        report = {'meta': {'created': timezone.now().isoformat(), 'commit': git_commit(),
+                           'python': platform.python_version(), 'django': django.get_version(),
+                           'db': connection.vendor, 'render_farm': settings.QR_RENDER_FARM,
+                           'records': options['records'], 'seed': options['seed']},
+                  'results': results}
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+        if options['compare']:
+            self.compare(report, options['compare'], options['threshold'])
+
+    @staticmethod
+    def time_calls(calls) -> dict:
+        """calls - list of no-argument functions, the first one is also run once untimed as warm up"""
+        calls[0]()
+        timings = []
+        for call in calls:
+            started = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return {'median_ms': round(statistics.median(timings), 4), 'mean_ms': round(statistics.mean(timings), 4),
+                'p95_ms': round(timings[max(int(len(timings) * 0.95) - 1, 0)], 4), 'min_ms': round(timings[0], 4),
+                'calls': len(timings)}
+
+    def cases(self, texts: list):
+        """(name, calls) in run order - later cases use rows created by the create_upn_model case"""
+        field_lists = [text.split('\n')[:20] for text in texts]
+        models = []
+        for text in texts:
+            parsed = parse_upn_text(text)
+            if is_err(parsed):
+                raise CommandError(f'Synthetic payload does not parse - {parsed.err_value}')
+            models.append(parsed.value['model'])
+
+        def create(text):
+            created = create_upn_model({'decodedText': text, 'result': '{"bench": 1}'}, render=False)
+            if is_err(created):
+                raise CommandError(f'create_upn_model failed - {created.err_value}')
+            return created.value['model']
+
+        def render_qr(record):
+            render_cache.clear()  # local tier only, with Redis configured misses may still hit the shared tier
+            return generate_qr_code(record)
+
+        yield 'parse.from_list', [lambda f=f: UpnBaseModel.from_list(f) for f in field_lists]
+        yield 'parse.parse_upn_text', [lambda t=t: parse_upn_text(t) for t in texts]
+        yield 'hash.md5_hash', [lambda m=m: md5_hash(m) for m in models]
+        yield 'db.create_upn_model.new', [lambda t=t: create(t) for t in texts]
+        yield 'db.create_upn_model.dup', [lambda t=t: create(t) for t in texts]
+
+        for text in texts:
+            create(text)  # rows for the cases below, also when --filter skipped the create cases
+        rows = list(UpnModel.objects.for_pdf().filter(md5__in=[m.md5_sum for m in models]))
+        epc_records = [EpcRecord.from_obj(row) for row in rows]
+        pdf_records = [PdfRecord.from_obj(row) for row in rows]
+        yield 'render.generate_qr_code', [lambda r=r: render_qr(r) for r in epc_records]
+        yield 'render.pdf_generate', [lambda r=r: UpnPdfGenerator().generate(r) for r in pdf_records]
+
+        client = Client()
+
+        def get(url, clear_cache=False):
+            if clear_cache:
+                render_cache.clear()
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'GET {url} - {response.status_code}')
+
+        def post_scan(text, clear_cache=False):
+            if clear_cache:
+                scan_cache.clear()
+            response = client.post('/api/v1/qr/', {'decodedText': text, 'result': '{"bench": 1}'},
+                                   HTTP_HX_REQUEST='true')
+            if response.status_code != 200 or not response.get('HX-Push-Url'):
+                raise CommandError(f'POST scan - {response.status_code}')
+
+        yield 'view.qr_open', [lambda r=r: get(f'/qr/{r.rnd}/') for r in rows]
+        yield 'view.qr_image.cold', [lambda r=r: get(f'/qr/{r.rnd}/qr.png', clear_cache=True) for r in rows]
+        for row in rows:
+            get(f'/qr/{row.rnd}/qr.png')  # the cold case kept only the last image
+        yield 'view.qr_image.cached', [lambda r=r: get(f'/qr/{r.rnd}/qr.png') for r in rows]
+        yield 'view.pdf', [lambda r=r: get(f'/qr/{r.rnd}/pdf/') for r in rows]
+        yield 'view.post_scan', [lambda t=t: post_scan(t, clear_cache=True) for t in texts]
+        for text in texts:
+            post_scan(text)  # fill the scan cache, the case above cleared it on every call
+        yield 'view.post_scan.repeat', [lambda t=t: post_scan(t) for t in texts]
+
+    def compare(self, report: dict, baseline_file: str, threshold: float) -> None:
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        self.stdout.write(f'\nCompared to {baseline_file} (commit {baseline["meta"].get("commit") or "?"}), '
+                          f'threshold +{threshold:.0%}')
+        self.stdout.write(f'{"case":<28} {"baseline ms":>12} {"current ms":>11} {"change":>8}')
+        regressions = []
+        for name, current in report['results'].items():
+            before = baseline['results'].get(name)
+            if before is None:
+                self.stdout.write(f'{name:<28} {"-":>12} {current["median_ms"]:>11.3f}      new')
+                continue
+            change = current['median_ms'] / before['median_ms'] - 1 if before['median_ms'] else 0.0
+            flag = ''
+            if change > threshold:
+                regressions.append(name)
+                flag = '  REGRESSION'
+            self.stdout.write(f'{name:<28} {before["median_ms"]:>12.3f} {current["median_ms"]:>11.3f} '
+                              f'{change:>+8.1%}{flag}')
+        if regressions:
+            raise CommandError(f'{len(regressions)} regression(s) over {threshold:.0%}: {", ".join(regressions)}')
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import random
+import statistics
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib import admin
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.qr.models import UpnModel
+from apps.qr.shortid import RandomShortId
+
+BENCH_MARKER = 'bench_db'
+SEED_CHUNK = 10000
+RENDER_FIELDS = ('md5', 'znesek', 'ime_prejemnika', 'iban_prejemnika', 'referenca')
+PAYERS = ('Janez Novak', 'Marija Horvat', 'Franc Kovačič', 'Ana Krajnc', 'Ivan Zupančič', 'Mojca Potočnik')
+RECIPIENTS = ('Snaga d.o.o.', 'Elektro Ljubljana', 'Telekom Slovenije', 'JP VOKA SNAGA', 'Petrol d.d.')
+
+
+def seed_model(n: int, now, rnd_id: str) -> UpnModel:
+    upn_model = UpnModel(ime_placnika=f'{random.choice(PAYERS)} {n}', ime_prejemnika=random.choice(RECIPIENTS),
+                         kraj_prejemnika=BENCH_MARKER, znesek=round(random.uniform(1, 999), 2),
+                         iban_prejemnika='SI56051008010486080', referenca=f'SI12 {n}', rnd=rnd_id,
+                         rok_placila=now + timedelta(days=n % 60))
+    upn_model.md5 = upn_model.md5_sum
+    upn_model.created = now - timedelta(seconds=n)
+    return upn_model
+
+
+class Command(BaseCommand):
+    help = 'Seed N UpnModel rows and time the access paths: rnd render lookup, md5 dedupe, admin paging and search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--number', type=int, default=500, help='Queries timed per access path')
+        parser.add_argument('--keep', action='store_true', help='Do not delete seeded rows at the end')
+
+    def handle(self, *args, **options):
+        try:
+            rows = options['rows']
+            samples = self.seed(rows)
+            model_admin = admin.site._registry[UpnModel]
+            pages = UpnModel.objects.count() // model_admin.list_per_page
+            paths = {
+                'rnd render lookup': lambda: UpnModel.objects.only(*RENDER_FIELDS).filter(
+                    rnd=random.choice(samples).rnd).first(),
+                'md5 dedupe': lambda: UpnModel.objects.filter(md5=random.choice(samples).md5).exists(),
+                'admin page 1': lambda: list(UpnModel.objects.order_by(*model_admin.ordering)[:100]),
+                'admin page deep': lambda: list(UpnModel.objects.order_by(*model_admin.ordering)[
+                    (pages - 1) * 100:pages * 100]),
+                'admin search common': lambda: self.admin_search(model_admin, random.choice(RECIPIENTS).split()[-1]),
+                'admin search rare': lambda: self.admin_search(model_admin, str(random.randrange(1000, rows))),
+                'icontains common': lambda: self.admin_search(None, random.choice(RECIPIENTS).split()[-1]),
+                'icontains rare': lambda: self.admin_search(None, str(random.randrange(1000, rows))),
+            }
+            self.stdout.write(f'{"path":<24} {"median ms":>10} {"p95 ms":>8}  plan')
+            for name, query in paths.items():
+                timings = []
+                for _ in range(options['number']):
+                    started = time.perf_counter()
+                    query()
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                self.stdout.write(f'{name:<24} {statistics.median(timings):>10.3f} '
+                                  f'{timings[int(len(timings) * 0.95) - 1]:>8.3f}  {self.plan(name, samples[0])}')
+        finally:
+            if not options['keep']:
+                UpnModel.objects.filter(kraj_prejemnika=BENCH_MARKER).delete()
+
+    @staticmethod
+    def search_queryset(model_admin, term: str):
+        """model_admin=None - plain icontains over search_fields, what the admin does without the index"""
+        queryset = UpnModel.objects.order_by('-created')
+        if model_admin is None:
+            return queryset.filter(Q(ime_placnika__icontains=term) | Q(ime_prejemnika__icontains=term))
+        return model_admin.get_search_results(None, queryset, term)[0]
+
+    def admin_search(self, model_admin, term: str):
+        """changelist work: result count for the paginator + first page"""
+        queryset = self.search_queryset(model_admin, term)
+        return queryset.count(), list(queryset[:100])
+
+    def plan(self, name: str, sample: UpnModel) -> str:
+        model_admin = admin.site._registry[UpnModel]
+        if name.startswith('rnd'):
+            queryset = UpnModel.objects.only(*RENDER_FIELDS).filter(rnd=sample.rnd)
+        elif name.startswith('md5'):
+            queryset = UpnModel.objects.filter(md5=sample.md5)
+        elif name.startswith('admin page'):
+            queryset = UpnModel.objects.order_by(*model_admin.ordering)
+        else:
+            queryset = self.search_queryset(None if name.startswith('icontains') else model_admin, 'Snaga')
+        return ' | '.join(line.strip() for line in queryset.explain().splitlines())[:120]
+
+    def seed(self, rows: int) -> list:
+        """Bulk insert benchmark rows, returns a sample of them for lookups"""
+        now, generator, samples = timezone.now(), RandomShortId(8), []
+        # auto_now_add would stamp every row with the same time, spread them like real traffic for -created paging
+        keep_created = mock.patch.object(UpnModel._meta.get_field('created'), 'auto_now_add', False)
+        for start in range(0, rows, SEED_CHUNK):
+            count = min(SEED_CHUNK, rows - start)
+            chunk = [seed_model(start + i, now, rnd_id) for i, rnd_id in enumerate(generator.allocate(count))]
+            with keep_created:
+                UpnModel.objects.bulk_create(chunk, ignore_conflicts=True)
+            samples.extend(random.sample(chunk, min(len(chunk), 100)))
+            self.stderr.write(f'{start + count} rows seeded', ending='\r')
+        self.stderr.write('')
+        return samples
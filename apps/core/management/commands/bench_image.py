@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.qr.epc import IMAGE_PROFILES, renderer
+from apps.qr.records import EpcRecord
+
+SAMPLE = EpcRecord(md5='', znesek=14.71, ime_prejemnika='Snaga d.o.o.', iban_prejemnika='SI56051008010486080',
+                   referenca='SI12 1033842574531')
+
+
+class Command(BaseCommand):
+    help = 'EPC QR image size and render latency per output profile (?format= / Accept of the image view)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"profile":<8} {"content type":<14} {"median ms":>10} {"mean ms":>9} {"bytes":>8}')
+        for profile in IMAGE_PROFILES.values():
+            renderer.render(SAMPLE, profile)  # warm up, loads fonts
+            timings = []
+            for _ in range(options['iterations']):
+                started = time.perf_counter()
+                image = renderer.render(SAMPLE, profile)
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(f'{profile.name:<8} {profile.content_type:<14} {statistics.median(timings):>10.1f} '
+                              f'{statistics.mean(timings):>9.1f} {len(image):>8}')
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import timeit
+from contextlib import nullcontext
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.qr import services, upn
+from apps.qr.models import UpnModel
+from apps.qr.upn import UpnBaseModel, parse_upn_list
+
+SAMPLE_UPN = ('UPNQR\n\n\n\n\nMARIJA ŠPELA ČEBULJ-KOŽELJ\nMAŠERA-SPASIĆEVA ULICA 1\n1000 LJUBLJANA\n00000001471\n\n\n'
+              'SCVE\nRavn. z odpadki 04/2016 0040098579\n17.04.2026\nSI56051008010486080\nSI121033842574531\n'
+              'Snaga d.o.o.\nPovšetova ulica 6\n1000 Ljubljana\n176').split('\n')
+# Text from outside ISO-8859-2 (pasted from Word, foreign names) - goes through the translate table
+SAMPLE_TRANSLITERATE = 'Győri Zsófia – Großhandel Straße 5 „račun“ 04/2026 … 12,50 €'
+
+# Minimal current vs legacy speedup, about a third of what is measured - below it the command fails
+# (apps.qr.tests.ParseBenchmarkTest runs it with UPN_BENCH=1)
+MIN_SPEEDUP = {'check_iso_8859_2': 10.0, 'transliterate': 1.5, 'from_list': 1.5}
+
+
+def legacy_check_iso_8859_2(data: str):
+    """check_iso_8859_2 before str.translate table, kept as the benchmark baseline"""
+    out = ''
+    for char in [ord(char) for char in data]:
+        if char in range(128, 159):
+            char = 95
+        out += chr(char)
+    return out
+
+
+class Command(BaseCommand):
+    help = ('Per-record UPN parse cost: legacy vs current ISO-8859-2 sanitizer, '
+            'pydantic UpnBaseModel vs fast-path parse_upn_list. Fails below the MIN_SPEEDUP of the sanitizer.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        number = options['number']
+        text = ' '.join(SAMPLE_UPN[5:8] + SAMPLE_UPN[12:13] + SAMPLE_UPN[16:19])
+
+        results = {}
+        for name, sanitizer in (('legacy', legacy_check_iso_8859_2), ('current', upn.check_iso_8859_2)):
+            with mock.patch.object(upn, 'check_iso_8859_2', sanitizer):
+                per_call = min(timeit.repeat(lambda: upn.check_iso_8859_2(text), number=number, repeat=3)) / number
+                per_translit = min(timeit.repeat(lambda: upn.check_iso_8859_2(SAMPLE_TRANSLITERATE),
+                                                 number=number, repeat=3)) / number
+                per_record = min(timeit.repeat(lambda: UpnBaseModel.from_list(SAMPLE_UPN),
+                                               number=number, repeat=3)) / number
+            results[name] = (per_call, per_translit, per_record)
+            self.stdout.write(f'{name:<8} check_iso_8859_2: {per_call * 1e6:7.2f} us/call   '
+                              f'transliterate: {per_translit * 1e6:7.2f} us/call   '
+                              f'from_list: {per_record * 1e6:7.2f} us/record')
+
+        speedup = {key: legacy / current
+                   for key, legacy, current in zip(MIN_SPEEDUP, results['legacy'], results['current'])}
+        self.stdout.write(f'speedup  check_iso_8859_2: {speedup["check_iso_8859_2"]:.1f}x   '
+                          f'transliterate: {speedup["transliterate"]:.1f}x   from_list: {speedup["from_list"]:.2f}x')
+
+        def pydantic_fields():
+            dumped = UpnBaseModel.from_list(SAMPLE_UPN).model_dump(warnings=False)
+            return {k: v for k, v in dumped.items() if k in UpnModel.FIELD_NAMES}
+
+        text = '\n'.join(SAMPLE_UPN)
+        timings = {}
+        force_pydantic = mock.patch.object(services, 'parse_upn_list', lambda fields: None)
+        for name, fields, context in (('pydantic', pydantic_fields, force_pydantic),
+                                      ('fast', lambda: parse_upn_list(SAMPLE_UPN), nullcontext())):
+            with context:
+                per_fields = min(timeit.repeat(fields, number=number, repeat=3)) / number
+                per_text = min(timeit.repeat(lambda: services.parse_upn_text(text), number=number, repeat=3)) / number
+            timings[name] = (per_fields, per_text)
+            self.stdout.write(f'{name:<8} fields -> kwargs: {per_fields * 1e6:7.2f} us/record   '
+                              f'parse_upn_text: {per_text * 1e6:7.2f} us/record')
+
+        self.stdout.write(f'speedup  fields -> kwargs: {timings["pydantic"][0] / timings["fast"][0]:.1f}x   '
+                          f'parse_upn_text: {timings["pydantic"][1] / timings["fast"][1]:.2f}x')
+
+        regressions = [f'{name} {speedup[name]:.2f}x < {minimum}x' for name, minimum in MIN_SPEEDUP.items()
+                       if speedup[name] < minimum]
+        if regressions:
+            raise CommandError(f'Parse speedup below threshold: {", ".join(regressions)}')
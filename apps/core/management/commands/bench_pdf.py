@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import statistics
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.qr.models import UpnModel
+from apps.qr.pdf_generator import UpnPdfGenerator
+
+
+def sample_model() -> UpnModel:
+    """Unsaved UpnModel, so the benchmark does not depend on DB content"""
+    return UpnModel(ime_placnika='Janez Novak', ulica_placnika='Lepa cesta 10', kraj_placnika='2000 Maribor',
+                    znesek=14.71, koda_namena='SCVE', namen_placila='Ravn. z odpadki 04/2016 0040098579',
+                    rok_placila=timezone.make_aware(datetime(2026, 4, 17, 12)),
+                    iban_prejemnika='SI56051008010486080', referenca='SI12 1033842574531',
+                    ime_prejemnika='Snaga d.o.o.', ulica_prejemnika='Povšetova ulica 6',
+                    kraj_prejemnika='1000 Ljubljana')
+
+
+class Command(BaseCommand):
+    help = 'Compare UpnPdfGenerator.generate() latency and size: pre-built template page vs drawing from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def handle(self, *args, **options):
+        upn_model = sample_model()
+        self.stdout.write(f'{"position":<8} {"template":<8} {"path":<9} {"median ms":>10} {"mean ms":>9} {"bytes":>8}')
+        for position in ('top', 'bottom'):
+            for draw_template in (True, False):
+                for prebuilt in (False, True):
+                    UpnPdfGenerator(position, draw_template, prebuilt=prebuilt).generate(upn_model)  # warm up
+                    timings = []
+                    for _ in range(options['iterations']):
+                        started = time.perf_counter()
+                        pdf_bytes = UpnPdfGenerator(position, draw_template, prebuilt=prebuilt).generate(upn_model)
+                        timings.append((time.perf_counter() - started) * 1000)
+                    self.stdout.write(f'{position:<8} {str(draw_template):<8} '
+                                      f'{"prebuilt" if prebuilt else "scratch":<9} '
+                                      f'{statistics.median(timings):>10.1f} {statistics.mean(timings):>9.1f} '
+                                      f'{len(pdf_bytes):>8}')
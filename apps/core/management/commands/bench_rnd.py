@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import statistics
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError
+from django.utils.module_loading import import_string
+
+from apps.qr import models
+from apps.qr.models import RndSequence, UpnModel
+from apps.qr.shortid import SequenceShortId
+
+BENCH_MARKER = 'bench_rnd'
+FILL_CHUNK = 10000
+
+
+def bench_model(n: int) -> UpnModel:
+    md5 = hashlib.blake2b(f'{BENCH_MARKER}:{time.time_ns()}:{n}'.encode('utf-8'), digest_size=16).hexdigest()
+    return UpnModel(znesek=1.0, iban_prejemnika='SI56051008010486080', referenca='SI00', ime_prejemnika=BENCH_MARKER,
+                    namen_placila=md5, md5=md5, rnd='')
+
+
+class Command(BaseCommand):
+    help = ('Load test for UpnModel.rnd generators: fill the table to --rows and measure '
+            'get_or_create_by_content latency and failures at each checkpoint')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generator', default='apps.qr.shortid.SequenceShortId')
+        parser.add_argument('--length', type=int, default=6)
+        parser.add_argument('--rows', type=int, default=10_000_000)
+        parser.add_argument('--checkpoints', type=int, default=10)
+        parser.add_argument('--samples', type=int, default=200, help='Single inserts timed per checkpoint')
+        parser.add_argument('--keep', action='store_true', help='Do not delete benchmark rows at the end')
+
+    def handle(self, *args, **options):
+        generator = import_string(options['generator'])(options['length'])
+        if isinstance(generator, SequenceShortId):
+            generator.sequence_name = BENCH_MARKER  # keep the real counter untouched
+        step = max(options['rows'] // options['checkpoints'], 1)
+        self.stdout.write(f'{options["generator"]} length={options["length"]}')
+        self.stdout.write(f'{"rows":>12} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8} {"failed":>7}')
+
+        n = 0
+        try:
+            with mock.patch.object(models, 'get_short_id_generator', lambda: generator):
+                for checkpoint in range(1, options['checkpoints'] + 1):
+                    n = self.fill(generator, n, checkpoint * step)
+                    timings, failed = [], 0
+                    for _ in range(options['samples']):
+                        n += 1
+                        started = time.perf_counter()
+                        try:
+                            UpnModel.get_or_create_by_content(bench_model(n))
+                        except (IntegrityError, OverflowError):
+                            failed += 1
+                        timings.append((time.perf_counter() - started) * 1000)
+                    timings.sort()
+                    self.stdout.write(f'{UpnModel.objects.count():>12} {statistics.median(timings):>8.2f} '
+                                      f'{timings[int(len(timings) * 0.99) - 1]:>8.2f} {timings[-1]:>8.2f} '
+                                      f'{failed:>7}')
+        finally:
+            if not options['keep']:
+                self.stderr.write('Deleting benchmark rows...')
+                UpnModel.objects.filter(ime_prejemnika=BENCH_MARKER).delete()
+                RndSequence.objects.filter(name=BENCH_MARKER).delete()
+
+    def fill(self, generator, n: int, target: int) -> int:
+        """bulk insert benchmark rows with pre-allocated rnd until the table has target rows"""
+        # ignore_conflicts hides skipped rows (random rnd collisions), so recount after each pass
+        while (missing := target - UpnModel.objects.count()) > 0:
+            while missing > 0:
+                chunk = [bench_model(n + i) for i in range(min(missing, FILL_CHUNK))]
+                n += len(chunk)
+                for upn_model, rnd_id in zip(chunk, generator.allocate(len(chunk))):
+                    upn_model.rnd = rnd_id
+                UpnModel.objects.bulk_create(chunk, ignore_conflicts=True)
+                missing -= len(chunk)
+                self.stderr.write(f'{target - missing} rows', ending='\r')
+        return n
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+import json
+import sys
+import time
+from collections import Counter
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from result import is_err
+
+from apps.qr.models import UpnModel
+from apps.qr.services import parse_upn_text
+from apps.qr.shortid import get_short_id_generator
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+def read_ndjson(stream):
+    """One record per line: JSON string or {"decodedText": "..."} object"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield None, f'Bad JSON line - {e}'
+            continue
+        if isinstance(record, dict):
+            record = record.get('decodedText')
+        if not isinstance(record, str):
+            yield None, 'Record is not a string or object with decodedText'
+            continue
+        yield record, None
+
+
+def read_nul(stream):
+    """Raw UPN texts separated by NUL, read in blocks so a record can span block boundary"""
+    tail = ''
+    while block := stream.read(READ_BLOCK_SIZE):
+        *records, tail = (tail + block).split('\0')
+        for record in records:
+            if record.strip():
+                yield record, None
+    if tail.strip():
+        yield tail, None
+
+
+def parse_records(records):
+    for text, error in records:
+        if error:
+            yield None, error
+            continue
+        parsed = parse_upn_text(text.strip('\n'))
+        if is_err(parsed):
+            yield None, parsed.err_value
+            continue
+        upn_model = parsed.value['model']
+        upn_model.md5 = upn_model.md5_sum
+        yield upn_model, None
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = 'Bulk import raw UPN QR texts (NDJSON lines or NUL separated) into UpnModel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='Input file, "-" for stdin')
+        parser.add_argument('--format', choices=['ndjson', 'nul'], default='ndjson',
+                            help='ndjson - one JSON string/object per line, nul - raw texts separated by \\0')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows per bulk insert')
+        parser.add_argument('--max-reject-reasons', type=int, default=20, help='Reject reasons shown in summary')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        reader = read_nul if options['format'] == 'nul' else read_ndjson
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8', newline='')
+        total, valid, inserted, collisions, rejects = 0, 0, 0, 0, Counter()
+        started = time.perf_counter()
+        try:
+            for chunk in chunked(parse_records(reader(stream)), options['chunk_size']):
+                batch = {}  # md5 -> UpnModel, duplicates inside the chunk are dropped here
+                for upn_model, error in chunk:
+                    if error:
+                        rejects[error.splitlines()[0][:200]] += 1
+                    else:
+                        batch.setdefault(upn_model.md5, upn_model)
+                        valid += 1
+                chunk_inserted, chunk_collisions = self.insert_chunk(batch)
+                inserted += chunk_inserted
+                collisions += chunk_collisions
+                total += len(chunk)
+                elapsed = time.perf_counter() - started
+                self.stderr.write(f'{total} records, {total / elapsed:.0f} records/s', ending='\r')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = time.perf_counter() - started
+        self.stderr.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f'Read {total} records in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} records/s): '
+            f'{valid} valid, {inserted} inserted, {valid - inserted} duplicates, '
+            f'{collisions} rnd collisions re-inserted, {sum(rejects.values())} rejected'))
+        for reason, count in rejects.most_common(options['max_reject_reasons']):
+            self.stdout.write(f'  {count:>8}  {reason}')
+
+    @staticmethod
+    def stored_digests(upn_models) -> dict:
+        """content digest -> md5 its row is stored under (new digest or legacy MD5), for the models already in DB"""
+        candidates = {}  # stored md5 (new or legacy) -> content digest
+        for upn_model in upn_models:
+            candidates.update({candidate: upn_model.md5 for candidate in upn_model.md5_candidates()})
+        return {candidates[md5]: md5
+                for md5 in UpnModel.objects.filter(md5__in=list(candidates)).values_list('md5', flat=True)}
+
+    @classmethod
+    def insert_chunk(cls, batch: dict) -> tuple:
+        """
+        Bulk insert md5 -> UpnModel, returns (inserted, rnd collisions).
+        Content already stored (under its md5 or legacy MD5) is filtered out first. The DB silently skips rows
+        whose rnd is taken, those are missing afterwards and go through get_or_create_by_content with a fresh rnd.
+        """
+        existing = cls.stored_digests(batch.values())
+        new_models = [upn_model for md5, upn_model in batch.items() if md5 not in existing]
+        for upn_model, rnd_id in zip(new_models, get_short_id_generator().allocate(len(new_models))):
+            upn_model.rnd = rnd_id
+        UpnModel.objects.bulk_create(new_models, ignore_conflicts=True)
+
+        stored = cls.stored_digests(new_models)
+        inserted = sum(stored[upn_model.md5] == upn_model.md5 for upn_model in new_models if upn_model.md5 in stored)
+        collided = [upn_model for upn_model in new_models if upn_model.md5 not in stored]
+        for upn_model in collided:
+            upn_model.rnd = ''
+            _, created = UpnModel.get_or_create_by_content(upn_model)
+            inserted += created
+        return inserted, len(collided)
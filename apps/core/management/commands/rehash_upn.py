@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.qr.models import UpnModel
+
+
+class Command(BaseCommand):
+    help = ('Rewrite UpnModel.md5 from legacy MD5 over JSON to the blake2b content digest. '
+            'Set QR_DIGEST_LEGACY_READ=False once it is done.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        seen = set(UpnModel.objects.values_list('md5', flat=True))
+        updated, kept, collisions = 0, 0, 0
+        chunk = []
+
+        def flush():
+            if chunk and not options['dry_run']:
+                with transaction.atomic():
+                    UpnModel.objects.bulk_update(chunk, ['md5'])
+            chunk.clear()
+
+        for upn_model in UpnModel.objects.order_by('pk').iterator(chunk_size=options['chunk_size']):
+            digest = upn_model.md5_sum
+            if upn_model.md5 == digest:
+                kept += 1
+                continue
+            if digest in seen:
+                # Legacy MD5 differed for the same content (e.g. deadline timezone), keep old row as is
+                collisions += 1
+                self.stdout.write(f'  duplicate content, md5 left as is: id={upn_model.pk} rnd={upn_model.rnd}')
+                continue
+            seen.add(digest)
+            upn_model.md5 = digest
+            chunk.append(upn_model)
+            updated += 1
+            if len(chunk) >= options['chunk_size']:
+                flush()
+        flush()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Would update" if options["dry_run"] else "Updated"} {updated}, already current {kept}, '
+            f'duplicates skipped {collisions}'))
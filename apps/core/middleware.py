@@ -2,8 +2,10 @@
 
 __author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
 
+from asgiref.sync import iscoroutinefunction
 from django.contrib.auth.middleware import RemoteUserMiddleware
 from django.contrib.auth.backends import RemoteUserBackend
+from django.utils.decorators import sync_and_async_middleware
 from ipware import get_client_ip  # type: ignore
 
 
@@ -16,33 +18,49 @@ class CustomRemoteUserBackend(RemoteUserBackend):
     create_unknown_user = False
 
 
+@sync_and_async_middleware
 def real_ip_middleware(get_response):  # type: ignore
     """Set REMOTE_ADDR for ip guessed by django-ipware.
     We need this to make sure all apps using remote ip are usable behind any kind of
     reverse proxy.
     If this does not work as you exepcted, check out django-ipware docs to configure it
     for your local needs: https://github.com/un33k/django-ipware
+    Sync and async, so async views are not pushed back into a thread under ASGI.
     """
 
-    def middleware(request):  # type: ignore
-        request.META["REMOTE_ADDR"] = get_client_ip(request)[0]
+    if iscoroutinefunction(get_response):
+        async def middleware(request):  # type: ignore
+            request.META["REMOTE_ADDR"] = get_client_ip(request)[0]
 
-        return get_response(request)
+            return await get_response(request)
+    else:
+        def middleware(request):  # type: ignore
+            request.META["REMOTE_ADDR"] = get_client_ip(request)[0]
+
+            return get_response(request)
 
     return middleware
 
 
+def _no_store_htmx(request, response):
+    if getattr(request, 'htmx', False):
+        response['Vary'] = 'HX-Request'
+        response['Cache-Control'] = 'no-store'
+    return response
+
+
+@sync_and_async_middleware
 def htmx_cache_middleware(get_response):
     """Prevent browsers and proxies from caching HTMX partial responses as full pages.
 
     Without Vary: HX-Request, a cached HTMX partial for /qr/{rnd}/ could be served
     to a regular browser request, showing a fragment without <head>/CSS.
     """
-    def middleware(request):
-        response = get_response(request)
-        if getattr(request, 'htmx', False):
-            response['Vary'] = 'HX-Request'
-            response['Cache-Control'] = 'no-store'
-        return response
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            return _no_store_htmx(request, await get_response(request))
+    else:
+        def middleware(request):
+            return _no_store_htmx(request, get_response(request))
 
     return middleware
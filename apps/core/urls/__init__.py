@@ -9,8 +9,8 @@ from django.contrib.sitemaps.views import sitemap
 from django.urls import path, reverse
 from django.views.generic import TemplateView
 
-from apps.core.views import MainPage, favicon
-from apps.qr.views import GetSaveQr, DownloadPdfView, DownloadQrImageView
+from apps.core.views import MainPage, favicon, metrics
+from apps.qr.views import GetSaveQr, DownloadPdfView, DownloadPdfBatchView, DownloadQrImageView, PdfJobView
 
 
 class StaticViewSitemap(sitemaps.Sitemap):
@@ -36,9 +36,12 @@ api = [
 urlpatterns = [
     path("qr/manual/", MainPage.as_view(), name='qr_manual', kwargs={'mode': 'manual'}),
     path("qr/scan/", MainPage.as_view(), name='qr_scan', kwargs={'mode': 'scan'}),
+    path("qr/pdf/batch/", DownloadPdfBatchView.as_view(), name='qr_pdf_batch'),
+    path("qr/pdf/job/<str:job_key>/", PdfJobView.as_view(), name='qr_pdf_job'),
     path("qr/<str:rnd_id>/edit/", MainPage.as_view(), name='qr_edit', kwargs={'mode': 'edit'}),
     path("qr/<str:rnd_id>/pdf/", DownloadPdfView.as_view(), name='qr_pdf_download'),
     path("qr/<str:rnd_id>/image/", DownloadQrImageView.as_view(), name='qr_image_download'),
+    path("qr/<str:rnd_id>/qr.png", DownloadQrImageView.as_view(), name='qr_image', kwargs={'inline': True}),
     path("qr/<str:rnd_id>/", GetSaveQr.as_view(), name='qr_open', kwargs={'mode': 'open'}),
 
     path('lang/', MainPage.as_view(), name='main_page_lang', kwargs={'mode': 'lang'}),
@@ -46,6 +49,7 @@ urlpatterns = [
 
     path("admin/", admin.site.urls),
     path("favicon.ico", favicon),
+    path("metrics", metrics),
     path("api/", include(api)),
 
     path(
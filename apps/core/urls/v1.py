@@ -4,6 +4,9 @@ __author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
 from django.urls import include
 from django.urls import path
 
+from apps.core.api.viewsets import UpnBatchConvertView
+
 urlpatterns = [
+    path('qr/batch/', UpnBatchConvertView.as_view(), name='api_qr_batch'),
     path('qr/', include("apps.qr.urls")),
 ]
@@ -6,15 +6,14 @@ from loguru import logger
 from decouple import config # noqa
 
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
 from django.views.decorators.http import require_GET
 from django.views.generic import CreateView, TemplateView, ListView, DetailView
 from django.shortcuts import render
 from django_htmx.http import push_url, HttpResponseClientRefresh, trigger_client_event, HttpResponseClientRedirect, HttpResponseLocation
-from result import is_err
 
-from apps.qr.epc import generate_qr_code
 from apps.qr.forms import QrManualForm, QrFullForm
+from apps.qr.metrics import render_latest
 from apps.qr.models import UpnModel
 
 
@@ -30,6 +29,15 @@ def favicon(request) -> HttpResponse:
     )
 
 
+@require_GET
+def metrics(request) -> HttpResponse:
+    # Prometheus scrape target, enabled with QR_METRICS=True - keep it off the public internet (proxy allow list)
+    if not settings.QR_METRICS:
+        raise Http404
+    body, content_type = render_latest()
+    return HttpResponse(body, content_type=content_type)
+
+
 class MainPage(TemplateView):
     template_name = "main.html"
     context_object_name = "result"
@@ -90,14 +98,9 @@ class MainPage(TemplateView):
             if not edit_model:
                 return render(request, "qr_open.html", {"mode": None})
             edit_model.data_type = "qr_edit"
-            img = generate_qr_code(edit_model)
-            if is_err(img):
-                edit_model, mode, show_form = None, None, True
-            else:
-                img = img.value
             response = render(request, "qr_open.html",
                               {"mode": "qr", "show_form": True, 'model': edit_model, "direct_get": True,
-                               "form": QrFullForm(instance=edit_model), "form_type": "full", "img": img})
+                               "form": QrFullForm(instance=edit_model), "form_type": "full"})
             return response
 
         else:
@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.utils.html import format_html
 
 from apps.qr.models import UpnModel
+from apps.qr.search import search_upn
 
 
 # Register your models here.
@@ -11,6 +12,13 @@ class UpnModelAdmin(admin.ModelAdmin):
                     'qr_link', 'data_type')
     readonly_fields = ('created', 'md5', 'modified', 'rnd')
     search_fields = ('ime_placnika', 'ime_prejemnika')
+    ordering = ('-created',)
+
+    def get_search_results(self, request, queryset, search_term):
+        indexed = search_upn(queryset, search_term)
+        if indexed is None:
+            return super().get_search_results(request, queryset, search_term)
+        return indexed, False
 
     @staticmethod
     def rok_placila_format(obj):
@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+from loguru import logger
 
 
 class QrConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.qr'
+
+    def ready(self):
+        from . import checks  # noqa - registers system checks
+        from .epc import renderer
+        from .search import install_search_index
+
+        post_migrate.connect(install_search_index, sender=self)
+        try:
+            renderer.load()
+        except OSError as e:  # fonts are retried lazily on the first render
+            logger.error(f'Can not preload QR fonts - {e}')
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from loguru import logger
+
+from .metrics import CACHE_REQUESTS_TOTAL
+
+
+class LruCache:
+    """Bounded in-process LRU cache, safe to share between request threads. timeout - seconds, None = no expiry"""
+
+    def __init__(self, max_size: int = 256, timeout: int | None = None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()  # key -> (expires at or None, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            expires, value = self._data[key]
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value) -> None:
+        if self.max_size <= 0:
+            return
+        expires = time.monotonic() + self.timeout if self.timeout else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TieredCache:
+    """
+    Two level cache: process local LRU in front of a Django cache from settings.CACHES.
+    Shared tier is optional (alias=None) and every error there is logged and ignored,
+    a broken Redis must never break rendering. Hits per tier and misses are counted per process (stats())
+    and in upn_cache_requests_total, labelled by the prefix up to the first ':' (version dropped).
+    """
+
+    def __init__(self, prefix: str, max_size: int = 256, alias: str | None = None, timeout: int | None = None):
+        self.prefix = prefix
+        self.local = LruCache(max_size, timeout)
+        self.alias = alias
+        self.timeout = timeout
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._requests = {result: CACHE_REQUESTS_TOTAL.labels(cache=prefix.split(':')[0], result=result)
+                          for result in ('local_hit', 'shared_hit', 'miss')}
+
+    def make_key(self, key: str) -> str:
+        return f'{self.prefix}:{key}'
+
+    @property
+    def shared(self):
+        return caches[self.alias] if self.alias else None
+
+    def get(self, key: str, default=None):
+        full_key = self.make_key(key)
+        value = self.local.get(full_key)
+        if value is not None:
+            self.local_hits += 1
+            self._requests['local_hit'].inc()
+            return value
+        if self.shared is not None:
+            try:
+                value = self.shared.get(full_key)
+            except Exception as e:
+                logger.warning(f'Shared cache get error ({full_key}) - {e}')
+                value = None
+            if value is not None:
+                self.shared_hits += 1
+                self._requests['shared_hit'].inc()
+                self.local.set(full_key, value)
+                return value
+        self.misses += 1
+        self._requests['miss'].inc()
+        return default
+
+    def peek(self, key: str, default=None):
+        """Local tier only, never does I/O - async views use it before handing work to a thread"""
+        value = self.local.get(self.make_key(key))
+        if value is None:
+            return default
+        self.local_hits += 1
+        self._requests['local_hit'].inc()
+        return value
+
+    def set(self, key: str, value) -> None:
+        full_key = self.make_key(key)
+        self.local.set(full_key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(full_key, value, timeout=self.timeout)
+            except Exception as e:
+                logger.warning(f'Shared cache set error ({full_key}) - {e}')
+
+    async def aget(self, key: str, default=None):
+        """get() for async views, the shared tier through the backend's aget"""
+        full_key = self.make_key(key)
+        value = self.local.get(full_key)
+        if value is not None:
+            self.local_hits += 1
+            self._requests['local_hit'].inc()
+            return value
+        if self.shared is not None:
+            try:
+                value = await self.shared.aget(full_key)
+            except Exception as e:
+                logger.warning(f'Shared cache get error ({full_key}) - {e}')
+                value = None
+            if value is not None:
+                self.shared_hits += 1
+                self._requests['shared_hit'].inc()
+                self.local.set(full_key, value)
+                return value
+        self.misses += 1
+        self._requests['miss'].inc()
+        return default
+
+    async def aset(self, key: str, value) -> None:
+        full_key = self.make_key(key)
+        self.local.set(full_key, value)
+        if self.shared is not None:
+            try:
+                await self.shared.aset(full_key, value, timeout=self.timeout)
+            except Exception as e:
+                logger.warning(f'Shared cache set error ({full_key}) - {e}')
+
+    def clear(self) -> None:
+        # Shared tier is versioned by key prefix, only the local tier is dropped
+        self.local.clear()
+
+    def stats(self) -> dict:
+        return {'local_hits': self.local_hits, 'shared_hits': self.shared_hits, 'misses': self.misses,
+                'local_size': len(self.local)}
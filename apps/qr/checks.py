@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
+
+from django.conf import settings
+from django.core.checks import Error, register
+from django.utils.module_loading import import_string
+
+from .shortid import SequenceShortId
+
+# Cache backends private to one process (or storing nothing) - a web process never sees what an RQ worker wrote
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',
+                        'django.core.cache.backends.dummy.DummyCache')
+
+
+@register()
+def pdf_async_cache_check(app_configs, **kwargs) -> list:
+    """QR_PDF_ASYNC hands rendered PDFs from the RQ worker to the poll view through the default cache"""
+    if not settings.QR_PDF_ASYNC:
+        return []
+    backend = settings.CACHES['default']['BACKEND']
+    if backend in PROCESS_LOCAL_CACHES:
+        return [Error(f'QR_PDF_ASYNC needs a default cache shared between processes, not {backend}',
+                      hint='Set REDIS_CACHE_URL or turn QR_PDF_ASYNC off.', id='qr.E001')]
+    return []
+
+
+@register()
+def rnd_key_check(app_configs, **kwargs) -> list:
+    """SequenceShortId maps counters to IDs with QR_RND_KEY - borrowing a rotating SECRET_KEY would reissue IDs"""
+    if not issubclass(import_string(settings.QR_RND_GENERATOR), SequenceShortId) or settings.QR_RND_KEY:
+        return []
+    return [Error('QR_RND_GENERATOR is SequenceShortId but QR_RND_KEY is empty',
+                  hint='Set QR_RND_KEY to a random string and never change it.', id='qr.E002')]
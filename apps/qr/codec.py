@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
+
+# UPN QR (20 LF separated fields, ZBS technical standard) and EPC QR (BCD 001/002) payloads.
+# Plain Python only - no Django, usable from batch workers and benchmarks without settings.
+
+import re
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+
+UPN_LEADING_STYLE = 'UPNQR'
+UPN_FIELD_COUNT = 20
+UPN_DATE_FORMAT = '%d.%m.%Y'
+
+# Fields 2-19 in standard order (field 1 is UPN_LEADING_STYLE, field 20 the checksum)
+UPN_FIELDS = ('iban_placnika', 'polog', 'dvig', 'referenca_placnika', 'ime_placnika', 'ulica_placnika',
+              'kraj_placnika', 'znesek', 'datum_placila', 'nujno', 'koda_namena', 'namen_placila', 'rok_placila',
+              'iban_prejemnika', 'referenca', 'ime_prejemnika', 'ulica_prejemnika', 'kraj_prejemnika')
+
+EPC_SERVICE_TAG = 'BCD'
+EPC_IDENTIFICATION = 'SCT'
+EPC_MIN_AMOUNT = 0.01
+EPC_MAX_AMOUNT = 999999999.99
+EPC_MAX_PAYLOAD = 331  # bytes
+# Character set field 1 .. 8
+EPC_ENCODINGS = ('utf-8', 'iso-8859-1', 'iso-8859-2', 'iso-8859-4', 'iso-8859-5', 'iso-8859-7', 'iso-8859-10',
+                 'iso-8859-15')
+
+
+class CodecError(ValueError):
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class UpnPayload:
+    """Decoded UPN QR: raw field text except znesek (EUR) and rok_placila (date)"""
+    iban_placnika: str = ''
+    polog: str = ''
+    dvig: str = ''
+    referenca_placnika: str = ''
+    ime_placnika: str = ''
+    ulica_placnika: str = ''
+    kraj_placnika: str = ''
+    znesek: float = 0.0
+    datum_placila: str = ''
+    nujno: str = ''
+    koda_namena: str = ''
+    namen_placila: str = ''
+    rok_placila: date | None = None
+    iban_prejemnika: str = ''
+    referenca: str = ''
+    ime_prejemnika: str = ''
+    ulica_prejemnika: str = ''
+    kraj_prejemnika: str = ''
+    kontrolna_vsota: str = ''
+
+    @property
+    def checksum_ok(self) -> bool:
+        return self.kontrolna_vsota == upn_checksum(upn_fields(self))
+
+
+@dataclass(frozen=True, slots=True)
+class EpcPayload:
+    """EPC QR (SEPA Credit Transfer), charset 1 = UTF-8"""
+    name: str
+    iban: str
+    amount: float
+    text: str = ''
+    reference: str = ''
+    bic: str = ''
+    purpose: str = ''
+    information: str = ''
+    version: str = '002'
+    charset: int = 1
+
+
+def _text(value) -> str:
+    return '' if value is None else str(value)
+
+
+def upn_amount(znesek) -> str:
+    """EUR amount -> 11 digit cents (field 9)"""
+    return f'{round(float(znesek or 0) * 100):011d}'
+
+
+def upn_fields(obj) -> list:
+    """
+    Fields 1-19 of a UPN QR from any object with UpnModel attribute names (UpnModel, PdfRecord, UpnPayload).
+    Attributes the object does not have (payer IBAN, deposit, ...) are empty.
+    IBAN and reference are written without spaces.
+    """
+    fields = [UPN_LEADING_STYLE]
+    for name in UPN_FIELDS:
+        value = getattr(obj, name, None)
+        if name == 'znesek':
+            fields.append(upn_amount(value))
+        elif name == 'rok_placila':
+            fields.append(value.strftime(UPN_DATE_FORMAT) if value else '')
+        elif name in ('iban_prejemnika', 'referenca'):
+            fields.append(_text(value).replace(' ', ''))
+        else:
+            fields.append(_text(value))
+    return fields
+
+
+def upn_checksum(fields: list) -> str:
+    """Field 20: sum of lengths of fields 1-19, each with its LF"""
+    return f'{sum(len(field) + 1 for field in fields):03d}'
+
+
+def encode_upn(obj) -> str:
+    """Complete UPN QR text, 20 fields each terminated by LF"""
+    fields = upn_fields(obj)
+    return '\n'.join(fields + [upn_checksum(fields)]) + '\n'
+
+
+def decode_upn(text: str) -> UpnPayload:
+    """
+    UPN QR text -> UpnPayload. Raises CodecError.
+    CR is ignored, fields after the 20th (some generators append e.g. EMAIL:...) are dropped.
+    """
+    fields = text.replace('\r', '').split('\n')
+    if fields[0] != UPN_LEADING_STYLE:
+        raise CodecError('Not a UPN QR code')
+    if len(fields) < UPN_FIELD_COUNT:
+        raise CodecError('Wrong list length')
+    values = dict(zip(UPN_FIELDS, fields[1:UPN_FIELD_COUNT - 1]))
+
+    amount = values['znesek'].strip()
+    if amount and not (amount.isascii() and amount.isdigit()):
+        raise CodecError(f'Invalid amount "{amount}"')
+    values['znesek'] = int(amount) / 100 if amount else 0.0
+
+    deadline = re.sub(r'\s+', '', values['rok_placila'])
+    try:
+        values['rok_placila'] = datetime.strptime(deadline, UPN_DATE_FORMAT).date() if deadline else None
+    except ValueError:
+        raise CodecError(f'Invalid rok_placila "{deadline}"')
+
+    return UpnPayload(**values, kontrolna_vsota=fields[UPN_FIELD_COUNT - 1])
+
+
+def epc_from_upn(obj) -> EpcPayload:
+    """EPC payload of a UPN slip: recipient, IBAN, amount (min. 0.01 EUR) and reference as remittance text"""
+    znesek = obj.znesek or 0
+    return EpcPayload(name=_text(obj.ime_prejemnika).strip(), iban=_text(obj.iban_prejemnika),
+                      amount=znesek if znesek >= EPC_MIN_AMOUNT else EPC_MIN_AMOUNT,
+                      text=_text(obj.referenca).rstrip())
+
+
+def epc_amount(amount) -> str:
+    return f'EUR{Decimal(amount):.2f}'.rstrip('0').rstrip('.')
+
+
+def encode_epc(payload: EpcPayload) -> str:
+    """EPC QR text, same checks and formatting as segno.helpers.make_epc_qr. Raises CodecError."""
+    if payload.version not in ('001', '002'):
+        raise CodecError(f'Invalid EPC version "{payload.version}"')
+    if payload.version == '001' and not payload.bic:
+        raise CodecError('BIC is required in EPC version 001')
+    if bool(payload.text) == bool(payload.reference):
+        raise CodecError('Either a text or a creditor reference (ISO 11649) must be provided')
+    if not 0 < len(payload.name) <= 70:
+        raise CodecError(f'Invalid name, max. 70 characters are allowed, got "{payload.name}"')
+    if not 4 < len(payload.iban) <= 34:
+        raise CodecError(f'Invalid IBAN, min. 5 and max. 34 characters are allowed, got "{payload.iban}"')
+    if not EPC_MIN_AMOUNT <= payload.amount <= EPC_MAX_AMOUNT:
+        raise CodecError(f'Invalid amount {payload.amount}')
+    if len(payload.text) > 140 or len(payload.reference) > 35:
+        raise CodecError('Remittance information is too long')
+    if payload.bic and len(payload.bic) not in (8, 11):
+        raise CodecError(f'Invalid BIC, should be 8 or 11 characters long, got "{payload.bic}"')
+    if payload.purpose and len(payload.purpose) != 4:
+        raise CodecError(f'Invalid purpose, 4 characters are allowed, got "{payload.purpose}"')
+    if not 1 <= payload.charset <= len(EPC_ENCODINGS):
+        raise CodecError(f'Invalid character set {payload.charset}')
+
+    lines = [EPC_SERVICE_TAG, payload.version, str(payload.charset), EPC_IDENTIFICATION, payload.bic,
+             payload.name, payload.iban, epc_amount(payload.amount), payload.purpose, payload.reference]
+    if payload.text or payload.information:
+        lines.append(payload.text)
+    if payload.information:
+        lines.append(payload.information)
+    text = '\n'.join(lines)
+    try:
+        size = len(text.encode(EPC_ENCODINGS[payload.charset - 1]))
+    except UnicodeEncodeError as e:
+        raise CodecError(f'Payload does not fit character set {payload.charset} - {e}')
+    if size > EPC_MAX_PAYLOAD:
+        raise CodecError(f'Payload is too big: Max. {EPC_MAX_PAYLOAD} bytes allowed, got {size} bytes')
+    return text
+
+
+def decode_epc(text: str) -> EpcPayload:
+    """EPC QR text -> EpcPayload. Raises CodecError."""
+    lines = text.replace('\r', '').split('\n')
+    if len(lines) < 10 or lines[0] != EPC_SERVICE_TAG or lines[3] != EPC_IDENTIFICATION:
+        raise CodecError('Not an EPC QR code')
+    if lines[1] not in ('001', '002'):
+        raise CodecError(f'Invalid EPC version "{lines[1]}"')
+    lines += [''] * (12 - len(lines))
+
+    amount = lines[7]
+    if amount and not re.fullmatch(r'EUR\d{1,9}(\.\d{1,2})?', amount):
+        raise CodecError(f'Invalid amount "{amount}"')
+    try:
+        charset = int(lines[2])
+    except ValueError:
+        raise CodecError(f'Invalid character set "{lines[2]}"')
+
+    return EpcPayload(name=lines[5], iban=lines[6], amount=float(amount[3:]) if amount else 0.0,
+                      text=lines[10], reference=lines[9], bic=lines[4], purpose=lines[8],
+                      information=lines[11], version=lines[1], charset=charset)
@@ -1,59 +1,227 @@
 # -*- coding: utf-8 -*-
 __author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
 
+from django.conf import settings
 from loguru import logger
-from segno import helpers
-from PIL import Image, ImageDraw, ImageFont
+import numpy as np
+import segno
+from PIL import Image, ImageColor, ImageDraw, ImageFont
 import io
+import os
 import base64
-from result import Result, Err, Ok
+from dataclasses import dataclass
+from result import Result, Err, Ok, is_err
 
-from .models import UpnModel
+from .cache import TieredCache
+from .codec import encode_epc, epc_from_upn
+from .farm import render_farm
+from .metrics import RENDER_ERRORS_TOTAL, stage
+from .records import EpcRecord
+
+# Bump on any change of the picture (scale, colors, fonts, text layout) - old cached images are dropped
+QR_RENDER_VERSION = 2
+
+
+@dataclass(frozen=True, slots=True)
+class ImageProfile:
+    """Output format of the QR image (EpcQrRenderer.encode)"""
+    name: str
+    content_type: str
+    extension: str
+
+
+# png - indexed palette (screen, default), print - 1-bit black and white PNG,
+# webp - lossless WebP, smallest raster, svg - vector QR straight from segno, without the text lines
+IMAGE_PROFILES = {profile.name: profile for profile in (
+    ImageProfile('png', 'image/png', 'png'),
+    ImageProfile('print', 'image/png', 'png'),
+    ImageProfile('webp', 'image/webp', 'webp'),
+    ImageProfile('svg', 'image/svg+xml', 'svg'),
+)}
+DEFAULT_IMAGE_PROFILE = IMAGE_PROFILES['png']
+
+render_cache = TieredCache(prefix=f'epc-qr:v{QR_RENDER_VERSION}',
+                           max_size=settings.QR_RENDER_CACHE_SIZE,
+                           alias=settings.QR_RENDER_CACHE_ALIAS,
+                           timeout=settings.QR_RENDER_CACHE_TIMEOUT)
+
+
+def get_fonts_dir() -> str:
+    # Use BASE_DIR/static for development, STATIC_ROOT for production (same as the PDF generator)
+    if getattr(settings, 'STATICFILES_DIRS', None):
+        return os.path.join(settings.STATICFILES_DIRS[0], 'fonts')
+    return os.path.join(settings.STATIC_ROOT, 'fonts')
 
 
 def get_text_dimensions(text_string, font):
     # https://stackoverflow.com/a/46220683/9263761
     ascent, descent = font.getmetrics()
 
-    text_width = font.getmask(text_string).getbbox()[2]
-    text_height = font.getmask(text_string).getbbox()[3] + descent
+    bbox = font.getmask(text_string).getbbox()
+    text_width = bbox[2]
+    text_height = bbox[3] + descent
 
     return text_width, text_height
 
 
-def generate_qr_code(data: UpnModel) -> Result:
-    out = io.BytesIO()
+class EpcQrRenderer:
+    """
+    Process wide EPC QR renderer.
+    Fonts are loaded once (QrConfig.ready), every render only encodes QR and draws two text lines.
+    The module matrix is rasterized straight into a palette image, PNG is encoded once at the end.
+    """
+
+    SCALE = 15
+    BORDER = 5
+    FINDER_DARK = '#209cdf'
+    FINDER_SIZE = 7  # modules, the three finder patterns in the corners
+    # Palette indexes and colors in the order segno's PNG writer uses, the output stays byte identical
+    DARK, FINDER, LIGHT = 0, 1, 2
+    PALETTE = (*ImageColor.getrgb('#000'), *ImageColor.getrgb(FINDER_DARK), *ImageColor.getrgb('#fff'))
+    # print: every palette color except the background is ink
+    PRINT_LUT = [0] * LIGHT + [255] + [0] * (255 - LIGHT)
+
+    # Encoder settings, see manage.py bench_image. Renders are cached, so size wins over encode time - up to a point:
+    # lossless WebP at method 4 / quality 50 is within 6 bytes of the maximum effort (method 6 / quality 100) at ~25 ms
+    # instead of ~1.4 s per render, and 26% smaller than the fastest setting.
+    PNG_COMPRESS_LEVEL = 9
+    WEBP_QUALITY = 50  # lossless: compression effort, not quality
+    WEBP_METHOD = 4
+
+    FONT_FILE = 'iosevka-term-regular.ttf'
+    COST_FONT_SIZE = 50
+    COST_COLOR = '#55a31d'
+    COST_TOP = 10  # px from the top edge
+    DESCR_FONT_SIZE = 44
+    DESCR_COLOR = '#a1290e'
+    DESCR_BOTTOM = 60  # px from the bottom edge
+
+    def __init__(self):
+        self.font_cost = None
+        self.font_descr = None
+
+    def load(self, fonts_dir: str | None = None) -> None:
+        if self.font_cost is not None:
+            return
+        font_path = os.path.join(fonts_dir or get_fonts_dir(), self.FONT_FILE)
+        self.font_cost = ImageFont.truetype(font_path, self.COST_FONT_SIZE)
+        self.font_descr = ImageFont.truetype(font_path, self.DESCR_FONT_SIZE)
+
+    def rasterize(self, qr: segno.QRCode) -> Image.Image:
+        """QR module matrix -> palette image: SCALE px per module, BORDER modules quiet zone, FINDER_DARK finders"""
+        size = len(qr.matrix)
+        modules = np.frombuffer(b''.join(qr.matrix), dtype=np.uint8).reshape(size, size).astype(bool)
+        finders = np.zeros((size, size), dtype=bool)
+        for row, col in ((0, 0), (0, size - self.FINDER_SIZE), (size - self.FINDER_SIZE, 0)):
+            finders[row:row + self.FINDER_SIZE, col:col + self.FINDER_SIZE] = True
+
+        pixels = np.full((size, size), self.LIGHT, dtype=np.uint8)
+        pixels[modules] = self.DARK
+        pixels[modules & finders] = self.FINDER
+        pixels = np.pad(pixels, self.BORDER, constant_values=self.LIGHT)
+        pixels = np.ascontiguousarray(pixels.repeat(self.SCALE, axis=0).repeat(self.SCALE, axis=1))
+
+        img = Image.frombuffer('P', (pixels.shape[1], pixels.shape[0]), pixels, 'raw', 'P', 0, 1)
+        img.putpalette(self.PALETTE)
+        return img
+
+    def encode(self, img: Image.Image, profile: ImageProfile) -> bytes:
+        out = io.BytesIO()
+        if profile.name == 'webp':
+            img.save(out, format='webp', lossless=True, quality=self.WEBP_QUALITY, method=self.WEBP_METHOD)
+        elif profile.name == 'print':
+            img = img.point(self.PRINT_LUT, 'L').convert('1', dither=Image.Dither.NONE)
+            img.save(out, format='png', compress_level=self.PNG_COMPRESS_LEVEL)
+        else:
+            img.save(out, format='png', compress_level=self.PNG_COMPRESS_LEVEL)
+        return out.getvalue()
+
+    def render(self, data: EpcRecord, profile: ImageProfile = DEFAULT_IMAGE_PROFILE) -> bytes:
+        self.load()
+        # EPC standard: error correction level M only, so boost_error is off (as in segno.helpers.make_epc_qr)
+        with stage('qr_segno'):
+            qr = segno.make_qr(epc_payload(data).encode('utf-8'), error='m', boost_error=False)
+        if profile.name == 'svg':
+            with stage('qr_encode'):
+                out = io.BytesIO()
+                qr.save(out, kind='svg', scale=self.SCALE, border=self.BORDER, finder_dark=self.FINDER_DARK,
+                        xmldecl=False, nl=False)
+            return out.getvalue()
+
+        with stage('qr_rasterize'):
+            img = self.rasterize(qr)
+
+        with stage('qr_draw_text'):
+            draw = ImageDraw.Draw(img)
+            img_width, img_height = img.size
+            text_cost = f'€ {data.znesek:.2f}'
+            text_referenca = data.ime_prejemnika
+            text_cost_width, _ = get_text_dimensions(text_cost, self.font_cost)
+            text_referenca_width, _ = get_text_dimensions(text_referenca, self.font_descr)
+
+            draw.text(((img_width/2)-(text_cost_width/2), self.COST_TOP), text_cost, fill=self.COST_COLOR,
+                      font=self.font_cost)
+            draw.text(((img_width/2)-(text_referenca_width/2), img_height-self.DESCR_BOTTOM), text_referenca,
+                      fill=self.DESCR_COLOR, font=self.font_descr)
+
+        with stage('qr_encode'):
+            return self.encode(img, profile)
+
+
+renderer = EpcQrRenderer()
+
+
+def render_cache_key(data: EpcRecord) -> str:
+    # Records and saved rows carry the content hash, unsaved UpnModel instances (forms) are hashed on the fly
+    return data.md5 or data.md5_sum
+
+
+def epc_payload(data: EpcRecord) -> str:
+    """EPC QR (BCD 002, UTF-8) text of the record, amount is raised to the 0.01 EUR EPC minimum"""
+    return encode_epc(epc_from_upn(data))
+
+
+def image_cache_key(data: EpcRecord, profile: ImageProfile = DEFAULT_IMAGE_PROFILE) -> str:
+    return f'{render_cache_key(data)}:{profile.name}'
+
+
+def peek_qr_image(data: EpcRecord, profile: ImageProfile = DEFAULT_IMAGE_PROFILE) -> bytes | None:
+    """Rendered image from the process local cache tier, None when it has to go through generate_qr_image"""
+    return render_cache.peek(image_cache_key(data, profile))
+
+
+def qr_image_etag(data: EpcRecord, profile: ImageProfile = DEFAULT_IMAGE_PROFILE) -> str:
+    """Strong ETag of the rendered image: content hash + render version + profile"""
+    return f'"{render_cache_key(data)}-{QR_RENDER_VERSION}-{profile.name}"'
+
+
+@stage('qr_image')
+def generate_qr_image(data: EpcRecord, profile: ImageProfile = DEFAULT_IMAGE_PROFILE) -> Result:
+    """
+    Rendered image as bytes - the core every caller should use.
+    The same bytes object goes renderer -> render cache -> HttpResponse without a copy
+    (BytesIO.getvalue() hands over its buffer, HttpResponse keeps bytes as they are, a memoryview it would copy).
+    """
     try:
-        # Ensure amount is at least 0.01 EUR (EPC standard minimum)
-        # This handles charity payments where amount might be 0
-        amount = data.znesek if data.znesek >= 0.01 else 0.01
-
-        qr = helpers.make_epc_qr(name=data.ime_prejemnika, iban=data.iban_prejemnika, amount=amount,
-                                 text=data.referenca, encoding='UTF-8')
-        qr.save(out, scale=15, border=5, kind='png', finder_dark='#209cdf')
-        out.seek(0)
-        img = Image.open(out)
-        img.convert('RGBA')
-        draw = ImageDraw.Draw(img)
-        font_cost = ImageFont.truetype('static/fonts/iosevka-term-regular.ttf', 50)
-        font_descr = ImageFont.truetype('static/fonts/iosevka-term-regular.ttf', 44)
-
-        img_width, img_height = img.size
-        text_cost = f'€ {data.znesek:.2f}'
-        text_referenca = data.ime_prejemnika
-        text_cost_width, _ = get_text_dimensions(text_cost, font_cost)
-        text_referenca_width, _ = get_text_dimensions(text_referenca, font_descr)
-
-        draw.text(((img_width/2)-(text_cost_width/2), 10), text_cost, fill='#55a31d', font=font_cost)
-        draw.text(((img_width/2)-(text_referenca_width/2), img_height-60), text_referenca, fill='#a1290e',
-                  font=font_descr)
-        img.resize((640, 640), Image.LANCZOS)
-
-        final_out = io.BytesIO()
-        img.save(final_out, format='png')
-        final_out.seek(0)
-        base64_img = base64.b64encode(final_out.getvalue()).decode("utf-8")
+        key = image_cache_key(data, profile)
+        image = render_cache.get(key)
+        if image is None:
+            image = render_farm.render_qr(data, profile) if render_farm.enabled() else renderer.render(data, profile)
+            render_cache.set(key, image)
     except Exception as e:
+        RENDER_ERRORS_TOTAL.labels(kind='qr').inc()
         return Err(f'Error create QR - {e}')
 
-    return Ok(base64_img)
+    return Ok(image)
+
+
+def generate_qr_png(data: EpcRecord) -> Result:
+    return generate_qr_image(data, DEFAULT_IMAGE_PROFILE)
+
+
+def generate_qr_code(data: EpcRecord, profile: ImageProfile = DEFAULT_IMAGE_PROFILE) -> Result:
+    """Base64 adapter of generate_qr_image, only for embedding - responses take the bytes"""
+    image = generate_qr_image(data, profile)
+    if is_err(image):
+        return image
+    return Ok(base64.b64encode(image.value).decode("utf-8"))
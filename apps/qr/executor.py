@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+class RenderPoolFull(Exception):
+    """All render slots are taken, the request is shed (503) instead of queued"""
+
+
+class RenderPool:
+    """
+    Bounded executor for the segno/PIL/fpdf work of async views, the event loop only awaits the result.
+    workers jobs run, queue_size more wait, run() raises RenderPoolFull for anything beyond that -
+    a request which would wait longer than a client waits is cheaper to refuse right away.
+    Jobs must not touch the database, pool threads keep no connection state.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # Started on first use, management commands and RQ workers never need the threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='qr-render')
+            return self._executor
+
+    async def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise RenderPoolFull(f'{self.workers} render jobs running and {self.queue_size} waiting')
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # Slot is freed when the job ends, not when the request does - a disconnected client's job still runs
+        future.add_done_callback(lambda _: self._slots.release())
+        return await asyncio.wrap_future(future)
+
+
+render_pool = RenderPool(settings.QR_RENDER_WORKERS, settings.QR_RENDER_QUEUE_SIZE)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
+
+# Process pool for CPU bound rendering (EPC QR images, UPN PDFs), enabled by settings.QR_RENDER_FARM.
+# Tasks take plain render specs (EpcRecord, PdfSpec) and return bytes, workers never touch the database.
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+
+from django.conf import settings
+from loguru import logger
+
+from .metrics import RENDER_ERRORS_TOTAL
+from .records import EpcRecord, PdfRecord
+
+_in_worker = False  # True inside farm processes, they render themselves instead of routing back
+WORKER_START_TIMEOUT = 300  # seconds for all workers to warm up, then the pool is given up as broken
+
+
+class RenderFarmError(Exception):
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class PdfSpec:
+    """UpnPdfGenerator arguments + records, batch=False renders records[0] with generate()"""
+    position: str
+    draw_template: bool
+    prebuilt: bool
+    records: tuple
+    batch: bool = False
+
+
+def _init_worker(ready) -> None:
+    """
+    Worker start (spawn): set up Django, load fonts, warm segno/PIL and the pre-built PDF pages.
+    ready is a Barrier of all workers, so no task runs before every worker is warm.
+    """
+    global _in_worker
+    _in_worker = True
+
+    import django
+    django.setup()
+
+    from .epc import DEFAULT_IMAGE_PROFILE, renderer
+    from .pdf_generator import UpnPdfGenerator
+
+    renderer.load()
+    renderer.render(EpcRecord(md5='', znesek=1.0, ime_prejemnika='warm up', iban_prejemnika='SI56051008010486080',
+                              referenca='SI00 0'), DEFAULT_IMAGE_PROFILE)
+    for position in ('top', 'bottom'):
+        for draw_template in (True, False):
+            UpnPdfGenerator._prebuilt_page(position, draw_template)
+    ready.wait(timeout=WORKER_START_TIMEOUT)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _render_qr(record: EpcRecord, profile) -> bytes:
+    from .epc import renderer
+    return renderer.render(record, profile)
+
+
+def _render_pdf(spec: PdfSpec) -> bytes:
+    from .pdf_generator import UpnPdfGenerator
+    generator = UpnPdfGenerator(position=spec.position, draw_template=spec.draw_template, prebuilt=spec.prebuilt)
+    if spec.batch:
+        return generator.generate_batch(spec.records)
+    return generator.generate(spec.records[0])
+
+
+class RenderFarm:
+    """
+    ProcessPoolExecutor of QR_RENDER_FARM_WORKERS spawned (not forked, the parent holds DB and Redis sockets
+    and threads) processes, all started and warmed by start(). Pools are per process: a fork of the owner
+    (gunicorn --preload, RQ work horse) starts its own on first use.
+    A task not done in QR_RENDER_FARM_TIMEOUT seconds fails the call, its worker finishes it in the background.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def enabled() -> bool:
+        return settings.QR_RENDER_FARM and not _in_worker
+
+    def start(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                workers = settings.QR_RENDER_FARM_WORKERS
+                context = multiprocessing.get_context('spawn')
+                executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                               initializer=_init_worker, initargs=(context.Barrier(workers),))
+                # Pre-fork: the pool spawns a worker per pending task, pings return once all are warm.
+                # Kept only when every worker came up, a failed warm up (BrokenProcessPool) is retried next time
+                try:
+                    for future in [executor.submit(_ping) for _ in range(workers)]:
+                        future.result()
+                except BaseException:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+                self._executor = executor
+                self._pid = os.getpid()
+                logger.info(f'Render farm started: {workers} workers')
+            return self._executor
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def run(self, fn, *args) -> bytes:
+        try:
+            future = self.start().submit(fn, *args)
+            return future.result(timeout=settings.QR_RENDER_FARM_TIMEOUT)
+        except FutureTimeoutError:
+            RENDER_ERRORS_TOTAL.labels(kind='farm').inc()
+            future.cancel()
+            raise RenderFarmError(f'Render task timed out after {settings.QR_RENDER_FARM_TIMEOUT}s')
+        except BrokenProcessPool as e:
+            RENDER_ERRORS_TOTAL.labels(kind='farm').inc()
+            logger.error(f'Render farm broken, restarting on next task - {e}')
+            self.shutdown()
+            raise RenderFarmError(f'Render worker died - {e}')
+
+    def render_qr(self, data, profile) -> bytes:
+        """EPC QR image of any object with EpcRecord fields (record, UpnModel)"""
+        return self.run(_render_qr, EpcRecord.from_obj(data), profile)
+
+    def render_pdf(self, position: str, draw_template: bool, prebuilt: bool, upn_models, batch: bool) -> bytes:
+        records = tuple(PdfRecord.from_obj(upn_model) for upn_model in upn_models)
+        return self.run(_render_pdf, PdfSpec(position, draw_template, prebuilt, records, batch))
+
+
+render_farm = RenderFarm()
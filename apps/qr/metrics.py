@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
+
+# Prometheus metrics, exposed at /metrics (apps.core.views.metrics).
+# Several worker processes (gunicorn, uvicorn --workers, render farm): start them with PROMETHEUS_MULTIPROC_DIR
+# set to an empty directory, every process then writes its samples there and /metrics sums all of them.
+
+import os
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest,
+                               multiprocess)
+
+# From sub-millisecond parsing up to multi-second PDF batches
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def collector(metric_class, name: str, documentation: str, labelnames, **kwargs):
+    """
+    Registered collector of that name, created on the first call. Registering again would raise DuplicateTimeseries
+    when the module is imported a second time under another name (qr.metrics next to apps.qr.metrics).
+    """
+    existing = REGISTRY._names_to_collectors.get(name)
+    if existing is not None:
+        return existing
+    return metric_class(name, documentation, labelnames, **kwargs)
+
+
+STAGE_SECONDS = collector(Histogram, 'upn_stage_seconds', 'Time spent per processing stage', ['stage'],
+                          buckets=STAGE_BUCKETS)
+DEDUPE_TOTAL = collector(Counter, 'upn_dedupe', 'UPN payloads stored as a new row or matched to an existing one',
+                         ['result'])
+RENDER_ERRORS_TOTAL = collector(Counter, 'upn_render_errors', 'Failed renders: qr, pdf, farm (timeout, dead worker)',
+                                ['kind'])
+CACHE_REQUESTS_TOTAL = collector(Counter, 'upn_cache_requests', 'TieredCache lookups: local_hit, shared_hit, miss',
+                                 ['cache', 'result'])
+
+
+def stage(name: str):
+    """Timer of one stage in STAGE_SECONDS, works as a context manager and as a decorator"""
+    return STAGE_SECONDS.labels(stage=name).time()
+
+
+def render_latest() -> tuple:
+    """(body, content type) of the Prometheus text format, aggregated over processes in multiprocess mode"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:58
+
+import apps.core.models
+import apps.qr.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UpnModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('modified', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('ime_placnika', models.CharField(blank=True, max_length=33)),
+                ('ulica_placnika', models.CharField(blank=True, max_length=33)),
+                ('kraj_placnika', models.CharField(blank=True, max_length=33)),
+                ('znesek', models.FloatField(max_length=10, validators=[apps.qr.models.validate_znesek])),
+                ('koda_namena', models.CharField(blank=True, max_length=4)),
+                ('namen_placila', models.CharField(blank=True, max_length=42)),
+                ('rok_placila', models.DateTimeField(blank=True, default=None, null=True)),
+                ('iban_prejemnika', models.CharField(max_length=34, validators=[apps.qr.models.validate_iban])),
+                ('referenca', models.CharField(max_length=26)),
+                ('ime_prejemnika', models.CharField(max_length=42)),
+                ('ulica_prejemnika', models.CharField(blank=True, max_length=33)),
+                ('kraj_prejemnika', models.CharField(blank=True, max_length=33)),
+                ('kontrolna_vsota', models.CharField(blank=True, max_length=3)),
+                ('md5', models.CharField(max_length=32, unique=True)),
+                ('rnd', models.CharField(default=apps.qr.models.rnd, max_length=6, unique=True)),
+                ('data_type', models.CharField(choices=[('qr', 'UPN QR'), ('qr_edit', 'UPN edit'), ('form', 'Form'), ('form_full', 'Form Full')], default='qr', max_length=10, verbose_name='')),
+            ],
+            options={
+                'verbose_name': 'UPN QR',
+                'verbose_name_plural': 'UPN QR',
+            },
+            bases=(apps.core.models.TestUtilsMixin, models.Model),
+        ),
+    ]
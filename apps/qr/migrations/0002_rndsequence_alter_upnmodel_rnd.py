@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:11
+
+import apps.qr.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RndSequence',
+            fields=[
+                ('name', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Short ID sequence',
+            },
+        ),
+        migrations.AlterField(
+            model_name='upnmodel',
+            name='rnd',
+            field=models.CharField(default=apps.qr.models.rnd, max_length=16, unique=True),
+        ),
+    ]
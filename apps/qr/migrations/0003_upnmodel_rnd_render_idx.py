@@ -0,0 +1,34 @@
+from django.db import migrations
+
+INDEX_NAME = 'qr_upn_rnd_render_idx'
+INCLUDE_COLUMNS = ('md5', 'znesek', 'ime_prejemnika', 'iban_prejemnika', 'referenca')
+
+
+def create_render_index(apps, schema_editor):
+    """
+    PostgreSQL: rnd index covering the EPC render columns, the QR lookup by rnd becomes an index-only scan.
+    Other backends have no INCLUDE, the unique rnd index already serves the lookup there.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    qn = schema_editor.quote_name
+    table = apps.get_model('qr', 'UpnModel')._meta.db_table
+    schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {qn(INDEX_NAME)} ON {qn(table)} ({qn("rnd")}) '
+                          f'INCLUDE ({", ".join(qn(column) for column in INCLUDE_COLUMNS)})')
+
+
+def drop_render_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {schema_editor.quote_name(INDEX_NAME)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0002_rndsequence_alter_upnmodel_rnd'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_render_index, drop_render_index),
+    ]
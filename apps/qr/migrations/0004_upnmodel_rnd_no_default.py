@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr', '0003_upnmodel_rnd_render_idx'),
+    ]
+
+    operations = [
+        # Python side default only, nothing changes in the database - a real AlterField would rebuild the whole
+        # table on SQLite for nothing.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='upnmodel',
+                    name='rnd',
+                    field=models.CharField(max_length=16, unique=True),
+                ),
+            ],
+        ),
+    ]
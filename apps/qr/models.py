@@ -1,32 +1,72 @@
 import hashlib
 import re
+from contextlib import nullcontext
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
 
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, connections, models, router, transaction
+from django.utils import timezone
 from loguru import logger
-import random
 import json
 
 from apps.core.models import TimestampedModel
+from .codec import upn_checksum, upn_fields
+from .records import EpcRecord, PdfRecord
+from .shortid import get_short_id_generator
 from django.core.exceptions import ValidationError
 from django.utils.dateparse import parse_datetime
 from django.core.serializers.json import DjangoJSONEncoder
 from django.utils.translation import gettext_lazy as _
 
 
-def rnd(rnd_len: int = 6) -> str:
-    return f'%0{rnd_len}x' % random.randrange(16**rnd_len)  # noqa
+def rnd() -> str:
+    """Next public short ID - called on insert only (save, get_or_create_by_content), not as a field default"""
+    return get_short_id_generator().next_id()
 
 
-def md5_hash(model: models.Model) -> str:
+# Fresh rnd attempts when an insert hits the unique rnd constraint
+RND_INSERT_ATTEMPTS = 5
+
+# Service fields, not part of the invoice content
+md5_pass_fields_list = ['id', 'md5', 'rnd', 'data_type', 'created', 'modified']
+
+
+def legacy_md5_hash(model: models.Model) -> str:
     """
-    Calculate MD5 hash of the model instance
+    MD5 over JSON of the model fields - content hash used before content_digest.
+    Only for reading old rows (settings.QR_DIGEST_LEGACY_READ) until `manage.py rehash_upn` is done.
     """
-    md5_pass_fields_list = ['id', 'md5', 'rnd', 'data_type', 'created', 'modified']
     fields = [f.name for f in model._meta.get_fields() if f.name not in md5_pass_fields_list]
     data = {f: getattr(model, f) for f in fields}
     return hashlib.md5(json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode('utf-8')).hexdigest()
 
 
+def canonical_value(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, (float, int, Decimal)) and not isinstance(value, bool):
+        return f'{float(value):.2f}'  # amount, cents are the precision of the invoice
+    if isinstance(value, datetime):
+        # Same moment must give the same digest, fresh (local tz) or loaded from DB (UTC)
+        return (value.astimezone(dt_timezone.utc) if timezone.is_aware(value) else value).isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def content_digest(values) -> str:
+    return hashlib.blake2b('\x1f'.join(canonical_value(v) for v in values).encode('utf-8'),
+                           digest_size=16).hexdigest()
+
+
+def md5_hash(model: models.Model) -> str:
+    """
+    Content hash of the model instance (stored in UpnModel.md5, 32 hex chars)
+    """
+    return content_digest(getattr(model, f) for f in model.DIGEST_FIELDS)
+
+
 def validate_iban(value) -> None:
     pattern = r'^[A-Z]{2}[0-9]{2}[A-Z0-9]{1,30}$'
     match = re.match(pattern, value.replace(' ', ''))
@@ -45,6 +85,16 @@ def validate_znesek(value) -> None:
         )
 
 
+class UpnQuerySet(models.QuerySet):
+    """Named projections for the render paths, rnd/data_type are there for links and the PDF gate"""
+
+    def for_epc(self, *extra):
+        return self.only(*EpcRecord.field_names(), 'rnd', 'data_type', *extra)
+
+    def for_pdf(self, *extra):
+        return self.only(*PdfRecord.field_names(), 'rnd', 'data_type', *extra)
+
+
 # DB Model for Telegram users
 class UpnModel(TimestampedModel):
     ime_placnika = models.CharField(max_length=33, blank=True)
@@ -62,98 +112,137 @@ class UpnModel(TimestampedModel):
     kontrolna_vsota = models.CharField(max_length=3, blank=True)
 
     md5 = models.CharField(max_length=32, blank=False, null=False, unique=True)
-    rnd = models.CharField(max_length=6, blank=False, null=False, unique=True, default=rnd)
+    rnd = models.CharField(max_length=16, blank=False, null=False, unique=True)  # assigned on insert
     data_type = models.CharField(choices=[('qr', 'UPN QR'), ('qr_edit', 'UPN edit'), ('form', 'Form'), ('form_full', 'Form Full')],
                                  default='qr', max_length=10, verbose_name='')
 
+    objects = UpnQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'UPN QR'
         verbose_name_plural = 'UPN QR'
+        # PostgreSQL only: covering rnd index for the QR render lookup, created by migration 0003
 
     def __str__(self):
         return f'{self.ime_placnika} / {self.ime_prejemnika}'
 
     @property
     def md5_sum(self):
-        return md5_hash(self)
+        """Content digest, computed once and reused until any content field changes"""
+        values = tuple(getattr(self, f) for f in self.DIGEST_FIELDS)
+        cached = getattr(self, '_digest_cache', None)
+        if cached is None or cached[0] != values:
+            cached = self._digest_cache = (values, content_digest(values))
+        return cached[1]
+
+    def md5_candidates(self) -> list:
+        """md5 values this content may be stored under (new digest + legacy MD5 during dual-read period)"""
+        if settings.QR_DIGEST_LEGACY_READ:
+            return [self.md5_sum, legacy_md5_hash(self)]
+        return [self.md5_sum]
 
     def calculate_kontrolna_vsota(self) -> str:
         """
-        Calculate control sum (field 20) according to UPN QR standard.
-        Control sum = sum of lengths of fields 1-19 including '\n' after each field.
+        Control sum (field 20) according to UPN QR standard: sum of lengths of fields 1-19 including '\n'.
 
         Returns:
             str: 3-digit string with leading zeros (e.g., "252")
         """
-        # Helper function to get field value or empty string
-        def get_field_value(value) -> str:
-            if value is None:
-                return ""
-            if isinstance(value, float):
-                # Convert amount to cents (e.g., 100.50 -> "00000010050")
-                return f"{int(value * 100):011d}"
-            if isinstance(value, str):
-                return value
-            return str(value)
-
-        # Format date field (DD.MM.YYYY or empty)
-        rok_placila_str = ""
-        if self.rok_placila:
-            rok_placila_str = self.rok_placila.strftime("%d.%m.%Y")
-
-        # Build array of 19 fields according to UPN QR standard
-        fields = [
-            "UPNQR",                              # 1. Leading style
-            "",                                    # 2. Payer's IBAN (empty for form)
-            "",                                    # 3. Deposit (empty)
-            "",                                    # 4. Withdrawal (empty)
-            "",                                    # 5. Payer's reference (empty)
-            get_field_value(self.ime_placnika),   # 6. Payer's name
-            get_field_value(self.ulica_placnika), # 7. Payer's street
-            get_field_value(self.kraj_placnika),  # 8. Payer's city
-            get_field_value(self.znesek),         # 9. Amount (in cents)
-            "",                                    # 10. Payment date (empty)
-            "",                                    # 11. Urgent (empty)
-            get_field_value(self.koda_namena),    # 12. Purpose code
-            get_field_value(self.namen_placila),  # 13. Purpose of payment
-            rok_placila_str,                       # 14. Payment deadline
-            get_field_value(self.iban_prejemnika).replace(" ", ""),  # 15. Recipient's IBAN
-            get_field_value(self.referenca),      # 16. Recipient's reference
-            get_field_value(self.ime_prejemnika), # 17. Recipient's name
-            get_field_value(self.ulica_prejemnika), # 18. Recipient's street
-            get_field_value(self.kraj_prejemnika),  # 19. Recipient's city
-        ]
-
-        # Calculate total length including '\n' after each field
-        total_length = sum(len(field) + 1 for field in fields)  # +1 for '\n'
-
-        # Return as 3-digit string with leading zeros
-        return f"{total_length:03d}"
+        return upn_checksum(upn_fields(self))
 
     @classmethod
     def create(cls, **kwargs):
         # Filter out non-existent fields
-        valid_fields = {f.name for f in cls._meta.get_fields()}
-        kwargs = {k: v for k, v in kwargs.items() if k in valid_fields}
+        kwargs = {k: v for k, v in kwargs.items() if k in cls.FIELD_NAMES}
         return cls.objects.create(**kwargs)
 
     @classmethod
     def fill(cls, **kwargs):
         # Filter out non-existent fields
-        valid_fields = {f.name for f in cls._meta.get_fields()}
-        kwargs = {k: v for k, v in kwargs.items() if k in valid_fields}
+        kwargs = {k: v for k, v in kwargs.items() if k in cls.FIELD_NAMES}
         return cls(**kwargs)
 
-    def save(self, *args, **kwargs):
-        created = self._state.adding
-
+    def fill_kontrolna_vsota(self) -> None:
         # Auto-calculate kontrolna_vsota for form_full type
         if self.data_type == 'form_full':
             self.kontrolna_vsota = self.calculate_kontrolna_vsota()
             logger.debug(f"Auto-calculated kontrolna_vsota: {self.kontrolna_vsota} for {self.data_type}")
 
+    @classmethod
+    def get_or_create_by_content(cls, upn_model: 'UpnModel' = None, **kwargs) -> tuple:
+        """
+        Atomic upsert by content digest, returns (UpnModel, created).
+        New content is written with one INSERT ... ON CONFLICT (md5) DO NOTHING RETURNING statement
+        (SQLite 3.35+ / PostgreSQL), the existing row is read only when that insert was a no-op.
+        Other backends insert and catch IntegrityError. Safe for concurrent scans of the same invoice.
+        """
+        if upn_model is None:
+            upn_model = cls.fill(**kwargs)
+        upn_model.fill_kontrolna_vsota()
+        upn_model.md5 = upn_model.md5_sum
+        if not upn_model.rnd:
+            upn_model.rnd = rnd()
+
+        if settings.QR_DIGEST_LEGACY_READ:
+            # Rows not yet rewritten by rehash_upn are not covered by the md5 unique constraint
+            existing = cls.objects.filter(md5__in=upn_model.md5_candidates()[1:]).first()
+            if existing:
+                return existing, False
+
+        using = router.db_for_write(cls, instance=upn_model)
+        connection = connections[using]
+        returning = (connection.vendor in ('sqlite', 'postgresql')
+                     and connection.features.can_return_columns_from_insert)
+        for _ in range(RND_INSERT_ATTEMPTS):
+            # Single statement is atomic by itself, savepoint only keeps an outer transaction usable on errors
+            block = transaction.atomic(using=using) if connection.in_atomic_block or not returning else nullcontext()
+            try:
+                with block:
+                    if returning:
+                        created = cls._insert_on_conflict_do_nothing(upn_model, using)
+                    else:
+                        super(UpnModel, upn_model).save(force_insert=True, using=using)
+                        created = True
+            except IntegrityError:
+                if not returning and cls.objects.using(using).filter(md5=upn_model.md5).exists():
+                    created = False
+                else:  # rnd collision, md5 conflicts are absorbed by ON CONFLICT
+                    upn_model.rnd = rnd()
+                    continue
+            if created:
+                return upn_model, True
+            existing = cls.objects.using(using).filter(md5=upn_model.md5).first()
+            if existing:
+                return existing, False
+        raise IntegrityError(f'Could not insert UpnModel {upn_model.md5} after {RND_INSERT_ATTEMPTS} attempts')
+
+    @classmethod
+    def _insert_on_conflict_do_nothing(cls, upn_model: 'UpnModel', using: str) -> bool:
+        """INSERT ... ON CONFLICT (md5) DO NOTHING RETURNING pk, sets pk/state on success"""
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        meta = cls._meta
+        fields = [f for f in meta.concrete_fields if not f.primary_key]
+        values = [f.get_db_prep_save(f.pre_save(upn_model, True), connection) for f in fields]
+        sql = (f'INSERT INTO {qn(meta.db_table)} ({", ".join(qn(f.column) for f in fields)}) '
+               f'VALUES ({", ".join(["%s"] * len(fields))}) '
+               f'ON CONFLICT ({qn(meta.get_field("md5").column)}) DO NOTHING RETURNING {qn(meta.pk.column)}')
+        with connection.cursor() as cursor:
+            cursor.execute(sql, values)
+            row = cursor.fetchone()
+        if row is None:
+            return False
+        upn_model.pk = meta.pk.to_python(row[0])
+        upn_model._state.adding = False
+        upn_model._state.db = using
+        return True
+
+    def save(self, *args, **kwargs):
+        created = self._state.adding
+        self.fill_kontrolna_vsota()
+
         # Check for duplicate MD5, but exclude current record when updating
-        duplicate_check = UpnModel.objects.filter(md5=self.md5_sum)
+        duplicate_check = UpnModel.objects.filter(md5__in=self.md5_candidates())
         if not created and self.pk:
             duplicate_check = duplicate_check.exclude(pk=self.pk)
 
@@ -161,8 +250,20 @@ class UpnModel(TimestampedModel):
             return
 
         self.md5 = self.md5_sum
+        if not self.rnd:
+            self.rnd = rnd()
+        super().save(*args, **kwargs)
 
-        if not created:
-            self.rnd = UpnModel.objects.filter(rnd=self.rnd).first().rnd
 
-        super().save(*args, **kwargs)
+class RndSequence(models.Model):
+    """Counters for apps.qr.shortid.SequenceShortId"""
+    name = models.CharField(max_length=32, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Short ID sequence'
+
+
+# Precomputed field names: all (fill/create filtering) and content fields in model order
+UpnModel.FIELD_NAMES = frozenset(f.name for f in UpnModel._meta.fields)
+UpnModel.DIGEST_FIELDS = tuple(f.name for f in UpnModel._meta.concrete_fields if f.name not in md5_pass_fields_list)
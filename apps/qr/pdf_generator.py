@@ -3,14 +3,21 @@ PDF Generator for UPN QR format
 Generates PDF documents according to UPN QR technical standard
 """
 from fpdf import FPDF
+from fontTools.ttLib import TTFont
 from django.conf import settings
 import os
 import warnings
-from datetime import datetime
+from datetime import datetime, timezone
+import copy
+import threading
 import segno
 from io import BytesIO
 from PIL import Image
 
+from .codec import encode_upn
+from .farm import render_farm
+from .metrics import RENDER_ERRORS_TOTAL, stage
+
 
 class UpnPdfGenerator:
     """Generator for UPN QR format PDF documents"""
@@ -20,26 +27,39 @@ class UpnPdfGenerator:
     PAGE_HEIGHT = 297  # mm (A4)
     FORM_HEIGHT = 99  # mm (UPN form height)
 
-    def __init__(self, position='top', draw_template=True):
+    # Pre-built first pages: (position, draw_template) -> FPDF with fonts registered and template drawn.
+    # Never output directly, every generator works on its own deep copy.
+    _prebuilt_pages = {}
+    _prebuilt_lock = threading.Lock()
+
+    def __init__(self, position='top', draw_template=True, prebuilt=True, offload=True):
         """
         Initialize PDF generator with custom settings
 
         Args:
             position: 'top' or 'bottom' - where to place the payment slip
             draw_template: bool - whether to draw the background template
+            prebuilt: bool - start from a cached copy of the first page (fonts + template) instead of building it
+            offload: bool - render in the render farm when settings.QR_RENDER_FARM is on
         """
-        self.position = position
         self.draw_template = draw_template
+        self.prebuilt = prebuilt
+        self._set_position(position)
 
-        # Calculate Y_BASE based on position
-        if position == 'bottom':
-            self.Y_BASE = self.PAGE_HEIGHT - self.FORM_HEIGHT  # 297 - 99 = 198mm
+        if offload and render_farm.enabled():
+            self.pdf = None  # generate() / generate_batch() run in a farm worker
+        elif prebuilt:
+            self.pdf = self._copy_prebuilt_page(position, draw_template)
         else:
-            self.Y_BASE = 0  # Start from top
+            self.pdf = self._new_pdf()
+        # First slip of a pre-built page already has its template (and template text state)
+        self._page_ready = prebuilt
 
-        self.pdf = FPDF(orientation='portrait', unit='mm', format="A4")
-        self.pdf.set_margin(0)
-        self.pdf.add_page()
+    @classmethod
+    def _new_pdf(cls):
+        pdf = FPDF(orientation='portrait', unit='mm', format="A4")
+        pdf.set_margin(0)
+        pdf.add_page()
 
         # Load fonts - use BASE_DIR/static for development, STATIC_ROOT for production
         if hasattr(settings, 'STATICFILES_DIRS') and settings.STATICFILES_DIRS:
@@ -47,9 +67,49 @@ class UpnPdfGenerator:
         else:
             fonts_dir = os.path.join(settings.STATIC_ROOT, 'fonts')
 
-        self.pdf.add_font("cour", style="", fname=os.path.join(fonts_dir, "Courier New.ttf"))
-        self.pdf.add_font("cour", style="b", fname=os.path.join(fonts_dir, "Courier New Bold.ttf"))
-        self.pdf.add_font("myriad", style="", fname=os.path.join(fonts_dir, "MyriadPro-Semibold.ttf"))
+        pdf.add_font("cour", style="", fname=os.path.join(fonts_dir, "Courier New.ttf"))
+        pdf.add_font("cour", style="b", fname=os.path.join(fonts_dir, "Courier New Bold.ttf"))
+        pdf.add_font("myriad", style="", fname=os.path.join(fonts_dir, "MyriadPro-Semibold.ttf"))
+        return pdf
+
+    @classmethod
+    def _prebuilt_page(cls, position, draw_template):
+        """
+        Returns (FPDF, {fontkey: TTF bytes}).
+        fpdf2 deepcopy shares TTFont objects between copies, but output() subsets them in place,
+        so every copy gets its own TTFont re-opened (lazy, cheap) from the bytes kept here.
+        """
+        key = (position, draw_template)
+        if key not in cls._prebuilt_pages:
+            with cls._prebuilt_lock:
+                if key not in cls._prebuilt_pages:
+                    builder = cls(position=position, draw_template=draw_template, prebuilt=False, offload=False)
+                    if draw_template:
+                        builder._draw_template()
+                    font_bytes = {}
+                    for fontkey, font in builder.pdf.fonts.items():
+                        buffer = BytesIO()
+                        font.ttfont.save(buffer)
+                        font_bytes[fontkey] = buffer.getvalue()
+                    cls._prebuilt_pages[key] = (builder.pdf, font_bytes)
+        return cls._prebuilt_pages[key]
+
+    @classmethod
+    def _copy_prebuilt_page(cls, position, draw_template):
+        prebuilt_pdf, font_bytes = cls._prebuilt_page(position, draw_template)
+        pdf = copy.deepcopy(prebuilt_pdf)
+        for fontkey, font in pdf.fonts.items():
+            font.ttfont = TTFont(BytesIO(font_bytes[fontkey]), recalcTimestamp=False, lazy=True)
+        pdf.set_creation_date(datetime.now(timezone.utc))
+        return pdf
+
+    def _set_position(self, position):
+        """Calculate Y_BASE based on position"""
+        self.position = position
+        if position == 'bottom':
+            self.Y_BASE = self.PAGE_HEIGHT - self.FORM_HEIGHT  # 297 - 99 = 198mm
+        else:
+            self.Y_BASE = 0  # Start from top
 
     def _draw_square(self, x, y, count):
         """Draw numbered squares for data entry"""
@@ -73,6 +133,7 @@ class UpnPdfGenerator:
         self.pdf.line(x, y, x + 4, y + 4)
         self.pdf.line(x, y + 4, x + 4, y)
 
+    @stage('pdf_draw_template')
     def _draw_template(self):
         """Draw the UPN QR form template"""
         Y_BASE = self.Y_BASE
@@ -431,7 +492,7 @@ class UpnPdfGenerator:
         self.pdf.write(text='https://upn-epc-qr.si/')
 
     def _fill_data(self, data):
-        """Fill template with data from UpnModel"""
+        """Fill template with data from PdfRecord (or UpnModel)"""
         Y_BASE = self.Y_BASE
 
         # Format amount with thousand separator and comma as decimal separator
@@ -621,85 +682,12 @@ class UpnPdfGenerator:
         Maximum length: 411 characters (Version 15)
 
         Args:
-            data: UpnModel instance
+            data: PdfRecord (or UpnModel instance)
 
         Returns:
             str: UPN QR data string
         """
-        # Field 1: Leading style (constant "UPNQR")
-        field_1 = "UPNQR"
-
-        # Field 2: Payer's IBAN (empty for payments)
-        field_2 = ""
-
-        # Field 3: Deposit (empty or "X")
-        field_3 = ""
-
-        # Field 4: Withdrawal (empty or "X")
-        field_4 = ""
-
-        # Field 5: Payer's reference (empty for this use case)
-        field_5 = ""
-
-        # Field 6: Payer's name
-        field_6 = data.ime_placnika if data.ime_placnika else ""
-
-        # Field 7: Payer's street
-        field_7 = data.ulica_placnika if data.ulica_placnika else ""
-
-        # Field 8: Payer's city
-        field_8 = data.kraj_placnika if data.kraj_placnika else ""
-
-        # Field 9: Amount in cents (multiply by 100, format with leading zeros)
-        amount_cents = int(data.znesek * 100)
-        field_9 = f"{amount_cents:011d}"  # 11 digits with leading zeros
-
-        # Field 10: Payment date (empty)
-        field_10 = ""
-
-        # Field 11: Urgent (empty or "X")
-        field_11 = ""
-
-        # Field 12: Purpose code
-        field_12 = data.koda_namena if data.koda_namena else ""
-
-        # Field 13: Purpose of payment
-        field_13 = data.namen_placila if data.namen_placila else ""
-
-        # Field 14: Payment deadline (format DD.MM.YYYY)
-        field_14 = ""
-        if data.rok_placila:
-            field_14 = data.rok_placila.strftime("%d.%m.%Y")
-
-        # Field 15: Recipient's IBAN (without spaces)
-        field_15 = data.iban_prejemnika.replace(' ', '') if data.iban_prejemnika else ""
-
-        # Field 16: Recipient's reference (without spaces)
-        field_16 = data.referenca.replace(' ', '') if data.referenca else ""
-
-        # Field 17: Recipient's name
-        field_17 = data.ime_prejemnika if data.ime_prejemnika else ""
-
-        # Field 18: Recipient's street
-        field_18 = data.ulica_prejemnika if data.ulica_prejemnika else ""
-
-        # Field 19: Recipient's city
-        field_19 = data.kraj_prejemnika if data.kraj_prejemnika else ""
-
-        # Field 20: Checksum (sum of lengths of fields 1-19 including \n)
-        fields_1_19 = [
-            field_1, field_2, field_3, field_4, field_5,
-            field_6, field_7, field_8, field_9, field_10,
-            field_11, field_12, field_13, field_14, field_15,
-            field_16, field_17, field_18, field_19
-        ]
-        checksum = sum(len(f) + 1 for f in fields_1_19)  # +1 for \n after each field
-        field_20 = f"{checksum:03d}"  # 3 digits with leading zeros
-
-        # Combine all fields with \n separator
-        upn_data = '\n'.join(fields_1_19 + [field_20]) + '\n'
-
-        return upn_data
+        return encode_upn(data)
 
     def _generate_upn_qr_image(self, upn_data):
         """
@@ -761,7 +749,7 @@ class UpnPdfGenerator:
         - Total field A25: 40mm x 39.5mm at position (63.5mm, Y_BASE+6.0mm)
 
         Args:
-            upn_model: UpnModel instance
+            upn_model: PdfRecord (or UpnModel instance)
         """
         Y_BASE = self.Y_BASE
 
@@ -790,25 +778,70 @@ class UpnPdfGenerator:
             h=qr_size   # 32.60mm
         )
 
+    def _draw_slip(self, upn_model):
+        """Draw one payment slip at current Y_BASE on current page"""
+        if self._page_ready:
+            self._page_ready = False
+        else:
+            # Same text state as a fresh FPDF, so every slip of a batch looks like a single one
+            self.pdf.set_stretching(100)
+            self.pdf.set_char_spacing(0)
+
+            # Draw template background (optional - for blank forms)
+            if self.draw_template:
+                self._draw_template()
+
+        # Always fill data and add QR code
+        self._fill_data(upn_model)
+        self._add_upn_qr_to_pdf(upn_model)
+
     def generate(self, upn_model):
         """
         Generate PDF for UPN QR document
 
         Args:
-            upn_model: UpnModel instance with payment data
+            upn_model: PdfRecord (or UpnModel instance) with payment data
 
         Returns:
             bytes: PDF document as bytes
         """
-        # Draw template background (optional - for blank forms)
-        if self.draw_template:
-            self._draw_template()
+        if self.pdf is None:
+            return render_farm.render_pdf(self.position, self.draw_template, self.prebuilt, [upn_model], batch=False)
+        try:
+            with stage('pdf_generate'):
+                self._draw_slip(upn_model)
+                return bytes(self.pdf.output())
+        except Exception:
+            RENDER_ERRORS_TOTAL.labels(kind='pdf').inc()
+            raise
+
+    def generate_batch(self, upn_models):
+        """
+        Generate one PDF with many UPN QR documents, two slips per A4 page (top, bottom).
+        Fonts are registered once for the whole document, so N slips cost much less than N generate() calls.
+        First slip goes to the position given to the constructor, next ones fill the pages in order.
 
-        # Always fill data and add QR code
-        self._fill_data(upn_model)
-        self._add_upn_qr_to_pdf(upn_model)
+        Args:
+            upn_models: iterable of PdfRecord (or UpnModel instances)
 
-        return bytes(self.pdf.output())
+        Returns:
+            bytes: PDF document as bytes
+        """
+        if self.pdf is None:
+            return render_farm.render_pdf(self.position, self.draw_template, self.prebuilt, upn_models, batch=True)
+        first_slot = 1 if self.position == 'bottom' else 0
+        try:
+            with stage('pdf_generate_batch'):
+                for slot, upn_model in enumerate(upn_models, start=first_slot):
+                    if slot > first_slot and slot % 2 == 0:
+                        self.pdf.add_page()
+                    self._set_position('top' if slot % 2 == 0 else 'bottom')
+                    self._draw_slip(upn_model)
+
+                return bytes(self.pdf.output())
+        except Exception:
+            RENDER_ERRORS_TOTAL.labels(kind='pdf').inc()
+            raise
 
     @staticmethod
     def generate_filename(upn_model):
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
+
+# Immutable render inputs, so EPC QR / PDF rendering does not need ORM instances.
+# Build them from UpnModel.objects.for_epc() / for_pdf() rows with from_obj().
+
+from dataclasses import dataclass, fields
+from datetime import datetime
+
+
+@dataclass(frozen=True, slots=True)
+class EpcRecord:
+    """Fields of the EPC QR image (epc.generate_qr_png)"""
+    md5: str
+    znesek: float
+    ime_prejemnika: str
+    iban_prejemnika: str
+    referenca: str
+
+    @classmethod
+    def field_names(cls) -> tuple:
+        return tuple(f.name for f in fields(cls))
+
+    @classmethod
+    def from_obj(cls, obj):
+        """Copy record fields from any object with the same attributes (UpnModel)"""
+        return cls(**{name: getattr(obj, name) for name in cls.field_names()})
+
+
+@dataclass(frozen=True, slots=True)
+class PdfRecord(EpcRecord):
+    """Fields of the UPN PDF slip (pdf_generator.UpnPdfGenerator)"""
+    ime_placnika: str = ''
+    ulica_placnika: str = ''
+    kraj_placnika: str = ''
+    koda_namena: str = ''
+    namen_placila: str = ''
+    rok_placila: datetime | None = None
+    ulica_prejemnika: str = ''
+    kraj_prejemnika: str = ''
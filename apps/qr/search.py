@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
+
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from loguru import logger
+
+# Admin recipient/payer search (UpnModelAdmin.search_fields)
+SEARCH_FIELDS = ('ime_placnika', 'ime_prejemnika')
+FTS_TABLE = 'qr_upnmodel_fts'
+TRIGRAM_MIN_LENGTH = 3  # shorter terms can not use trigram indexes
+
+
+def sqlite_fts_enabled(connection) -> bool:
+    """FTS5 trigram tokenizer needs SQLite 3.34+"""
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 34)
+
+
+def install_search_index(using: str = 'default', **kwargs) -> None:
+    """
+    post_migrate handler: substring search index for SEARCH_FIELDS, vendor specific so it lives outside migrations.
+    PostgreSQL - pg_trgm GIN index on UPPER(field) (what icontains queries), SQLite - FTS5 trigram table with triggers.
+    """
+    from .models import UpnModel
+
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    table = UpnModel._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for field in SEARCH_FIELDS:
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS {qn(f"{table}_{field}_trgm")} ON {qn(table)} '
+                               f'USING gin (UPPER({qn(field)}::text) gin_trgm_ops)')
+        elif sqlite_fts_enabled(connection):
+            tables = connection.introspection.table_names(cursor)
+            if table not in tables:  # migrated back to zero
+                return
+            # A table rebuild (SQLite AlterField/AddField) drops the triggers, so they are checked on every migrate
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [table])
+            triggers = {row[0] for row in cursor.fetchall()}
+            if FTS_TABLE in tables and {f'{FTS_TABLE}_ai', f'{FTS_TABLE}_ad', f'{FTS_TABLE}_au'} <= triggers:
+                return
+            columns = ', '.join(SEARCH_FIELDS)
+            new_values = ', '.join(f'new.{field}' for field in SEARCH_FIELDS)
+            old_values = ', '.join(f'old.{field}' for field in SEARCH_FIELDS)
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5({columns}, content='{table}', "
+                           f"content_rowid='id', tokenize='trigram')")
+            cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {table} BEGIN '
+                           f'INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END')
+            cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {table} BEGIN '
+                           f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) "
+                           f"VALUES ('delete', old.id, {old_values}); END")
+            cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON {table} BEGIN '
+                           f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) "
+                           f"VALUES ('delete', old.id, {old_values}); "
+                           f'INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END')
+            # Rows written while the triggers were missing are not in the index
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+            logger.info(f'Installed {FTS_TABLE} search index')
+
+
+def search_upn(queryset, search_term: str):
+    """
+    queryset filtered by every word of search_term in any SEARCH_FIELDS (admin semantics) through FTS5 on SQLite,
+    None when the index can not serve it (other backend or short word) - caller falls back to icontains
+    """
+    connection = connections[queryset.db]
+    words = search_term.split()
+    if not words or not sqlite_fts_enabled(connection) or any(len(w) < TRIGRAM_MIN_LENGTH for w in words):
+        return None
+    for word in words:
+        phrase = '"' + word.replace('"', '""') + '"'
+        queryset = queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+                                                 [phrase]))
+    return queryset
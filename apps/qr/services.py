@@ -1,15 +1,19 @@
 # -*- coding: utf-8 -*-
 __author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
 
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 from loguru import logger
 from result import Result, Err, Ok, is_err
 import hashlib
 import json
 
-from .epc import generate_qr_code
+from .codec import CodecError
+from .epc import epc_payload, generate_qr_png
+from .metrics import DEDUPE_TOTAL, stage
 from .models import UpnModel
-from .upn import UpnBaseModel
+from .shortid import get_short_id_generator
+from .upn import UpnBaseModel, parse_upn_list
 from .forms import QrForm, QrManualForm
 
 
@@ -17,75 +21,151 @@ def create_md5_hash(data) -> str:
     return hashlib.md5(data).hexdigest()
 
 
-def create_upn_model(form_data: str) -> Result:
+def parse_upn_text(decoded_text: str) -> Result:
     """
-    form_data is request.POST bytes - 'decodedText': str, 'result': { json }
-    decodedText looks like  "UPNQR\n\n\n\n\nIME MARIO\nMAŠERA-SPASIĆEVA ULICA 1\n1000 LJUBLJANA\n...."
+    Parse raw UPN QR text to unsaved UpnModel
+    decoded_text looks like  "UPNQR\n\n\n\n\nIME MARIO\nMAŠERA-SPASIĆEVA ULICA 1\n1000 LJUBLJANA\n...."
     """
-    qr_form_data = QrForm(form_data)
-    if qr_form_data.is_valid():
-        try:
-            # Convert decodedText to list (\n - separator)
-            qr_form_data_list = qr_form_data.cleaned_data['decodedText'].replace('\r', '').split('\n')
-        except Exception as e:
-            return Err(f'Error split decodedText data - {e}')
-
-        if not qr_form_data_list or qr_form_data_list[0] != 'UPNQR':
-            logger.error(f'Not a UPN QR code, first field: {repr(qr_form_data_list[0] if qr_form_data_list else "empty")}')
-            return Err('Not a UPN QR code')
-        if len(qr_form_data_list) < 20:
-            logger.error(f'Wrong list length: {len(qr_form_data_list)}, data: {repr(qr_form_data_list)}')
-            return Err('Wrong list length')
-        if len(qr_form_data_list) > 20:  # some generators append extra fields (e.g. EMAIL:...)
-            logger.warning(f'Extra UPN fields ignored: {repr(qr_form_data_list[20:])}')
-            qr_form_data_list = qr_form_data_list[:20]
+    try:
+        # Convert decodedText to list (\n - separator)
+        qr_form_data_list = decoded_text.replace('\r', '').split('\n')
+    except Exception as e:
+        return Err(f'Error split decodedText data - {e}')
 
+    if not qr_form_data_list or qr_form_data_list[0] != 'UPNQR':
+        logger.error(f'Not a UPN QR code, first field: {repr(qr_form_data_list[0] if qr_form_data_list else "empty")}')
+        return Err('Not a UPN QR code')
+    if len(qr_form_data_list) < 20:
+        logger.error(f'Wrong list length: {len(qr_form_data_list)}, data: {repr(qr_form_data_list)}')
+        return Err('Wrong list length')
+    if len(qr_form_data_list) > 20:  # some generators append extra fields (e.g. EMAIL:...)
+        logger.warning(f'Extra UPN fields ignored: {repr(qr_form_data_list[20:])}')
+        qr_form_data_list = qr_form_data_list[:20]
+
+    try:
         # Check if original amount was zero (field #8 in UPN format)
         original_amount_cents = int(qr_form_data_list[8]) if qr_form_data_list[8] else 0
-        amount_was_zero = original_amount_cents == 0
+    except ValueError as e:
+        return Err(f'Error parse amount - {e}')
+    amount_was_zero = original_amount_cents == 0
 
+    upn_fields = parse_upn_list(qr_form_data_list)
+    if upn_fields is None:
+        # Not a canonical payload - pydantic model gives the detailed error (or accepts an unusual form)
         try:
-            # Convert list to Upn pydantic model
             upn_base_model = UpnBaseModel.from_list(qr_form_data_list)
         except Exception as e:
             return Err(f'Error convert to BaseModel model - {e}')
+        upn_fields = {k: v for k, v in upn_base_model.model_dump(warnings=False).items() if k in UpnModel.FIELD_NAMES}
 
-        try:
-            # Dump BaseModel to dict, correct rok_placila to timezone aware, create md5 hash for unique model
-            upn_base_model_dict = upn_base_model.model_dump(warnings=False)
-            if upn_base_model_dict['rok_placila']:
-                upn_base_model_dict['rok_placila'] = timezone.make_aware(upn_base_model_dict['rok_placila'])
-            else:
-                # If rok_placila is empty, set next day at 00:00:00 to avoid duplicates
-                # All invoices scanned on the same day without deadline will have same rok_placila
-                from datetime import datetime, timedelta
-                tomorrow = datetime.now() + timedelta(days=1)
-                tomorrow_midnight = tomorrow.replace(hour=0, minute=0, second=0, microsecond=0)
-                upn_base_model_dict['rok_placila'] = timezone.make_aware(tomorrow_midnight)
-            # logger.warning(json.dumps(upn_base_model.model_dump_json(warnings=False),
-            #                                                         sort_keys=True).encode('utf-8'))
-            # logger.warning(upn_base_model.model_dump())
-            # upn_base_model_dict['md5'] = create_md5_hash(json.dumps(upn_base_model.model_dump_json(warnings=False),
-            #                                                         sort_keys=True).encode('utf-8'))
-        except Exception as e:
-            return Err(f'Error parse UpnModel BaseModel - {e}')
-
-        upn_model = UpnModel.fill(**upn_base_model_dict)
-        upn_model_exist = UpnModel.objects.filter(md5=upn_model.md5_sum).first()
-        if upn_model_exist:
-            upn_model = upn_model_exist
+    try:
+        # Correct rok_placila to timezone aware
+        if upn_fields['rok_placila']:
+            upn_fields['rok_placila'] = timezone.make_aware(upn_fields['rok_placila'])
         else:
-            try:
-                upn_model.save()
-            except Exception as e:
-                return Err(f'Error create UpnModel - {e}')
+            # If rok_placila is empty, set next day at 00:00:00 to avoid duplicates
+            # All invoices scanned on the same day without deadline will have same rok_placila
+            from datetime import datetime, timedelta
+            tomorrow = datetime.now() + timedelta(days=1)
+            tomorrow_midnight = tomorrow.replace(hour=0, minute=0, second=0, microsecond=0)
+            upn_fields['rok_placila'] = timezone.make_aware(tomorrow_midnight)
+    except Exception as e:
+        return Err(f'Error parse UpnModel BaseModel - {e}')
+
+    return Ok({
+        # rnd is assigned on insert, so duplicates do not use up short IDs
+        'model': UpnModel(**upn_fields),
+        'amount_was_auto_set': amount_was_zero
+    })
+
+
+@stage('create_upn_model')
+def create_upn_model(form_data: str, render: bool = True) -> Result:
+    """
+    form_data is request.POST bytes - 'decodedText': str, 'result': { json }
+    decodedText looks like  "UPNQR\n\n\n\n\nIME MARIO\nMAŠERA-SPASIĆEVA ULICA 1\n1000 LJUBLJANA\n...."
+    render=False skips the EPC render check, the async view renders on the render pool itself
+    """
+    with stage('form_validation'):
+        qr_form_data = QrForm(form_data)
+        valid = qr_form_data.is_valid()
+    if not valid:
+        return Err(f'Invalid form data - {qr_form_data.errors.as_text()}')
+
+    with stage('parse'):
+        parsed = parse_upn_text(qr_form_data.cleaned_data['decodedText'])
+    if is_err(parsed):
+        return parsed
+
+    try:
+        with stage('dedupe'):
+            upn_model, created = UpnModel.get_or_create_by_content(parsed.value['model'])
+    except Exception as e:
+        return Err(f'Error create UpnModel - {e}')
+    DEDUPE_TOTAL.labels(result='created' if created else 'duplicate').inc()
 
-        qr_img = generate_qr_code(upn_model)
+    # Render once here to surface EPC errors, the page itself loads the image by URL (from render cache)
+    if render:
+        qr_img = generate_qr_png(upn_model)
         if is_err(qr_img):
             return Err(f'Error generate QR code - {qr_img.err}')
 
-        return Ok({
-            'model': upn_model,
-            'img': qr_img.value,
-            'amount_was_auto_set': amount_was_zero
-        })
+    return Ok({
+        'model': upn_model,
+        'amount_was_auto_set': parsed.value['amount_was_auto_set']
+    })
+
+
+def create_upn_models_bulk(decoded_texts: list) -> list:
+    """
+    Batch variant of create_upn_model for the API: list of raw UPN texts -> list of Result (same order).
+    Ok values carry the EPC text ('epc'), items it can not be encoded for are Err and never stored.
+    Duplicates are collapsed by md5 inside the batch and against DB with one query,
+    new rows are written with one bulk insert.
+    """
+    results = [parse_upn_text(text) if isinstance(text, str) else Err('decodedText must be a string')
+               for text in decoded_texts]
+    for i, result in enumerate(results):
+        if is_err(result):
+            continue
+        try:
+            result.value['epc'] = epc_payload(result.value['model'])
+        except CodecError as e:
+            results[i] = Err(f'Error create EPC payload - {e}')
+
+    batch = {}  # md5 -> UpnModel, first occurrence wins
+    for result in results:
+        if is_err(result):
+            continue
+        upn_model = result.value['model']
+        upn_model.md5 = upn_model.md5_sum
+        result.value['model'] = batch.setdefault(upn_model.md5, upn_model)
+
+    candidates = {}  # stored md5 (new or legacy) -> content digest
+    for md5, upn_model in batch.items():
+        candidates.update({candidate: md5 for candidate in upn_model.md5_candidates()})
+    existing = {candidates[m.md5]: m for m in UpnModel.objects.filter(md5__in=list(candidates))}
+    new_models = [m for md5, m in batch.items() if md5 not in existing]
+    if new_models:
+        for upn_model, rnd_id in zip(new_models, get_short_id_generator().allocate(len(new_models))):
+            upn_model.rnd = rnd_id
+        try:
+            with transaction.atomic():
+                UpnModel.objects.bulk_create(new_models)
+        except IntegrityError as e:
+            # Concurrent insert of the same invoice or rnd collision - fall back to one by one upsert,
+            # rows inserted meanwhile by someone else are reported as existing
+            logger.warning(f'Bulk create UpnModel failed, inserting one by one - {e}')
+            for upn_model in new_models:
+                stored, created = UpnModel.get_or_create_by_content(upn_model)
+                if not created:
+                    existing[upn_model.md5] = stored
+    batch.update(existing)
+
+    for i, result in enumerate(results):
+        if is_err(result):
+            continue
+        created = result.value['model'].md5 not in existing
+        DEDUPE_TOTAL.labels(result='created' if created else 'duplicate').inc()
+        results[i] = Ok({**result.value, 'model': batch[result.value['model'].md5], 'created': created})
+    return results
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
+
+import hashlib
+import random
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, router, transaction
+from django.utils.module_loading import import_string
+
+
+class ShortIdGenerator:
+    """
+    Public short ID (UpnModel.rnd) source, selected by settings.QR_RND_GENERATOR.
+    next_id() - one ID, allocate(count) - IDs for a bulk insert.
+    """
+
+    def __init__(self, length: int):
+        self.length = length
+        self.space = 16 ** length
+
+    def format(self, number: int) -> str:
+        return f'{number:0{self.length}x}'
+
+    def next_id(self) -> str:
+        raise NotImplementedError
+
+    def allocate(self, count: int) -> list:
+        return [self.next_id() for _ in range(count)]
+
+
+class RandomShortId(ShortIdGenerator):
+    """Random hex, collisions are left to the unique constraint (retried by UpnModel.get_or_create_by_content)"""
+
+    def next_id(self) -> str:
+        return self.format(random.randrange(self.space))
+
+    def allocate(self, count: int) -> list:
+        return [self.format(n) for n in random.sample(range(self.space), count)]
+
+
+class FeistelPermutation:
+    """
+    Keyed bijection on [0, 16**length): balanced Feistel network over 4*length bits.
+    Sequential counters become non-guessable IDs which never collide.
+    """
+    ROUNDS = 4
+
+    def __init__(self, length: int, key: str):
+        self.half_bits = length * 2
+        self.mask = (1 << self.half_bits) - 1
+        self.round_keys = [hashlib.blake2b(f'{key}:{i}'.encode('utf-8'), digest_size=16).digest()
+                           for i in range(self.ROUNDS)]
+
+    def _round(self, i: int, value: int) -> int:
+        digest = hashlib.blake2b(value.to_bytes(8, 'big'), key=self.round_keys[i], digest_size=8).digest()
+        return int.from_bytes(digest, 'big') & self.mask
+
+    def permute(self, number: int) -> int:
+        left, right = number >> self.half_bits, number & self.mask
+        for i in range(self.ROUNDS):
+            left, right = right, left ^ self._round(i, right)
+        return (left << self.half_bits) | right
+
+    def invert(self, number: int) -> int:
+        left, right = number >> self.half_bits, number & self.mask
+        for i in reversed(range(self.ROUNDS)):
+            left, right = right ^ self._round(i, left), left
+        return (left << self.half_bits) | right
+
+
+class SequenceShortId(ShortIdGenerator):
+    """
+    Dense collision-free IDs: counter from the DB sequence (RndSequence) through FeistelPermutation.
+    Counters are reserved in blocks of settings.QR_RND_BLOCK_SIZE per process, so most IDs need no query.
+    Use another QR_RND_LENGTH than the random IDs already stored when switching, the spaces then never overlap.
+    The key (settings.QR_RND_KEY) must never change, counters issued so far would map to other IDs.
+    """
+
+    def __init__(self, length: int, key: str = None, block_size: int = None):
+        super().__init__(length)
+        key = key or settings.QR_RND_KEY
+        if not key:
+            raise ImproperlyConfigured('SequenceShortId needs QR_RND_KEY')
+        self.permutation = FeistelPermutation(length, key)
+        self.block_size = block_size or settings.QR_RND_BLOCK_SIZE
+        self.sequence_name = 'upn_rnd'
+        self._block = iter(())
+        self._lock = threading.Lock()
+
+    def reserve(self, count: int) -> range:
+        """Reserve count counters with one statement, returns the range"""
+        from .models import RndSequence
+
+        using = router.db_for_write(RndSequence)
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        table = qn(RndSequence._meta.db_table)
+        if connection.vendor in ('sqlite', 'postgresql') and connection.features.can_return_columns_from_insert:
+            with connection.cursor() as cursor:
+                cursor.execute(f'INSERT INTO {table} ({qn("name")}, {qn("value")}) VALUES (%s, %s) '
+                               f'ON CONFLICT ({qn("name")}) DO UPDATE SET {qn("value")} = {table}.{qn("value")} '
+                               f'+ excluded.{qn("value")} RETURNING {qn("value")}', [self.sequence_name, count])
+                end = cursor.fetchone()[0]
+        else:
+            with transaction.atomic(using=using):
+                sequence, _ = RndSequence.objects.using(using).select_for_update().get_or_create(
+                    name=self.sequence_name)
+                sequence.value += count
+                sequence.save(update_fields=['value'])
+                end = sequence.value
+        if end > self.space:
+            raise OverflowError(f'Short ID space 16**{self.length} is exhausted, increase QR_RND_LENGTH')
+        return range(end - count, end)
+
+    def next_id(self) -> str:
+        with self._lock:
+            counter = next(self._block, None)
+            if counter is None:
+                self._block = iter(self.reserve(self.block_size))
+                counter = next(self._block)
+        return self.format(self.permutation.permute(counter))
+
+    def allocate(self, count: int) -> list:
+        return [self.format(self.permutation.permute(n)) for n in self.reserve(count)]
+
+
+@lru_cache(maxsize=None)
+def get_short_id_generator() -> ShortIdGenerator:
+    return import_string(settings.QR_RND_GENERATOR)(settings.QR_RND_LENGTH)
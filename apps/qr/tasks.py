@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
+
+import hashlib
+
+import django_rq
+from django.conf import settings
+from django.core.cache import cache
+from loguru import logger
+
+from .models import UpnModel
+from .pdf_generator import UpnPdfGenerator
+from .records import PdfRecord
+
+PDF_QUEUE = 'default'
+PENDING_STATUSES = ('queued', 'started', 'deferred', 'scheduled')
+
+
+def pdf_job_key(upn_models, position: str, draw_template: bool) -> str:
+    """Rendered PDF depends only on content (md5), position and template flag"""
+    md5s = ','.join(m.md5 for m in upn_models)
+    return hashlib.md5(f'{md5s}:{position}:{int(draw_template)}'.encode('utf-8')).hexdigest()
+
+
+def _cache_key(key: str) -> str:
+    return f'upn-pdf:{key}'
+
+
+def get_rendered_pdf(key: str) -> dict | None:
+    """{'pdf': bytes, 'filename': str} when the job is done"""
+    return cache.get(_cache_key(key))
+
+
+def render_pdf_job(key: str, rnd_ids: list, position: str, draw_template: bool, filename: str) -> str:
+    """RQ job: render one or many UPN slips to PDF and keep it in the cache under key"""
+    upn_models = UpnModel.objects.for_pdf().filter(rnd__in=rnd_ids).in_bulk(field_name='rnd')
+    upn_models = [PdfRecord.from_obj(upn_models[rnd_id]) for rnd_id in rnd_ids if rnd_id in upn_models]
+    # RQ forks a work horse per job, a render farm would be spawned and warmed for every job
+    generator = UpnPdfGenerator(position=position, draw_template=draw_template, offload=False)
+    pdf_bytes = generator.generate_batch(upn_models)
+    cache.set(_cache_key(key), {'pdf': pdf_bytes, 'filename': filename}, timeout=settings.QR_PDF_CACHE_TIMEOUT)
+    logger.info(f'PDF job {key} done: {len(upn_models)} slips, {len(pdf_bytes)} bytes')
+    return key
+
+
+def enqueue_pdf_job(upn_models, position: str, draw_template: bool, filename: str) -> str:
+    """Enqueue render_pdf_job once per key, repeated requests while it runs reuse the same job"""
+    key = pdf_job_key(upn_models, position, draw_template)
+    queue = django_rq.get_queue(PDF_QUEUE)
+    job = queue.fetch_job(key)
+    if job is None or job.get_status() not in PENDING_STATUSES:
+        queue.enqueue(render_pdf_job, key, [m.rnd for m in upn_models], position, draw_template, filename,
+                      job_id=key, result_ttl=settings.QR_PDF_CACHE_TIMEOUT, failure_ttl=60)
+    return key
+
+
+def pdf_job_status(key: str) -> str | None:
+    """RQ status of the job, None once it is unknown or its record expired (failure_ttl, result_ttl)"""
+    job = django_rq.get_queue(PDF_QUEUE).fetch_job(key)
+    return job.get_status() if job is not None else None
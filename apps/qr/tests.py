@@ -1,3 +1,392 @@
-from django.test import TestCase
+import json
+import os
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import replace
+from datetime import date
+from io import StringIO
+from unittest import mock, skipUnless
+from uuid import uuid4
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from result import is_err
+from prometheus_client import Counter
+from segno.helpers import _make_epc_qr_data
+
+from . import services
+from .checks import rnd_key_check
+from .codec import (CodecError, EpcPayload, UpnPayload, decode_epc, decode_upn, encode_epc, encode_upn,
+                    epc_from_upn)
+from .farm import RenderFarm, RenderFarmError
+from .forms import QrFullForm, QrManualForm
+from .metrics import DEDUPE_TOTAL, collector
+from .models import RndSequence, UpnModel, legacy_md5_hash
+from .search import FTS_TABLE, install_search_index, search_upn
+from .views import scan_cache
+from .shortid import FeistelPermutation, SequenceShortId
+from .upn import UpnBaseModel, parse_upn_list
+
+
+def upn_text(**fields) -> str:
+    """Raw UPN QR text as the scanner posts it (no final LF)"""
+    values = dict(ime_placnika='Janez Novak', ulica_placnika='Slovenska cesta 1', kraj_placnika='1000 Ljubljana',
+                  znesek=14.71, koda_namena='OTHR', namen_placila='Ravn. z odpadki 01/2026',
+                  rok_placila=date(2026, 2, 1), iban_prejemnika='SI56051008010486080',
+                  referenca='SI12 1033842574531', ime_prejemnika='Snaga d.o.o.', ulica_prejemnika='Povšetova 6',
+                  kraj_prejemnika='1000 Ljubljana')
+    values.update(fields)
+    return encode_upn(UpnPayload(**values)).rstrip('\n')
+
+
+def upsert(**fields) -> tuple:
+    """get_or_create_by_content of upn_text(**fields), as create_upn_model calls it"""
+    return UpnModel.get_or_create_by_content(services.parse_upn_text(upn_text(**fields)).value['model'])
+
+
+class UpnBatchConvertViewTest(TestCase):
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_user(email='api@example.com', password='x'))
+
+    def test_epc_error_fails_only_its_item(self):
+        bad = upn_text(ime_prejemnika='', referenca='SI00 1')
+        response = self.client.post(reverse('api_qr_batch'), [upn_text(), bad], content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        good_item, bad_item = response.json()['results']
+        self.assertTrue(good_item['ok'])
+        self.assertTrue(good_item['epc'].startswith('BCD\n002\n1\nSCT\n'))
+        self.assertFalse(bad_item['ok'])
+        self.assertIn('EPC', bad_item['error'])
+        self.assertEqual(response.json()['errors'], 1)
+        self.assertEqual(UpnModel.objects.count(), 1)  # the bad item is not stored
+
+
+class FastPathParserTest(SimpleTestCase):
+    """parse_upn_list must give exactly what UpnBaseModel gives, or None and leave the input to it"""
+
+    CANONICAL = [
+        {},
+        {'znesek': 0.0, 'rok_placila': None, 'koda_namena': ''},
+        {'ime_placnika': 'Marija Špela Čebulj-Koželj', 'ulica_placnika': 'Mašera-Spasićeva ulica 1',
+         'ime_prejemnika': 'Občina Šmarje pri Jelšah'},
+        {'ime_placnika': 'Ana \x85Krajnc\x9e', 'namen_placila': 'Članarina \x80 2026'},  # C1 controls
+        {'znesek': 99999999.99, 'referenca': 'SI99 '},
+        {'ime_prejemnika': 'Zavod za zdravstveno zavarovanje Slovenije'},  # over 33 characters
+    ]
+
+    @staticmethod
+    def pydantic_fields(fields: list) -> dict:
+        dumped = UpnBaseModel.from_list(fields).model_dump(warnings=False)
+        return {k: v for k, v in dumped.items() if k in UpnModel.FIELD_NAMES}
+
+    def test_canonical_payloads_match_pydantic(self):
+        for values in self.CANONICAL:
+            with self.subTest(values=values):
+                fields = upn_text(**values).split('\n')
+                self.assertEqual(parse_upn_list(fields), self.pydantic_fields(fields))
+
+    def test_non_canonical_payloads_are_left_to_pydantic(self):
+        canonical = upn_text().split('\n')
+        for index, value in ((8, '0000000147,1'), (8, '０００００００１４７１'), (13, '１７.04.2026'),
+                             (13, '17.04.２０２６'), (13, '17.\xa004.2026'), (13, '2026-04-17'), (0, 'UPN')):
+            with self.subTest(index=index, value=value):
+                fields = canonical.copy()
+                fields[index] = value
+                self.assertIsNone(parse_upn_list(fields))
+
+    def test_parse_upn_text_same_with_and_without_fast_path(self):
+        canonical = upn_text().split('\n')
+        for deadline in ('17.04.2026', '17. 04. 2026', '7.4.2026', '17.04.２０２６', '１７.04.2026', '31.02.2026'):
+            with self.subTest(deadline=deadline):
+                text = '\n'.join(canonical[:13] + [deadline] + canonical[14:])
+                fast = services.parse_upn_text(text)
+                with mock.patch.object(services, 'parse_upn_list', lambda fields: None):
+                    slow = services.parse_upn_text(text)
+                self.assertEqual(is_err(fast), is_err(slow))
+                if not is_err(fast):
+                    self.assertEqual(*[{f: getattr(r.value['model'], f) for f in UpnModel.DIGEST_FIELDS}
+                                       for r in (fast, slow)])
+
+
+class GetOrCreateByContentTest(TestCase):
+    """Single statement upsert (INSERT ... ON CONFLICT DO NOTHING RETURNING) and the insert + IntegrityError path"""
+
+    def assert_upsert(self):
+        created_model, created = upsert()
+        self.assertTrue(created)
+        self.assertIsNotNone(created_model.pk)
+        self.assertTrue(created_model.rnd)
+
+        existing_model, created = upsert()
+        self.assertFalse(created)
+        self.assertEqual(existing_model.pk, created_model.pk)
+        self.assertEqual(existing_model.rnd, created_model.rnd)
+        self.assertEqual(UpnModel.objects.count(), 1)
+
+        # The duplicate left the surrounding transaction (TestCase atomic block) usable
+        _, created = upsert(znesek=1.0)
+        self.assertTrue(created)
+        self.assertEqual(UpnModel.objects.count(), 2)
+
+    def test_on_conflict_returning(self):
+        self.assertTrue(connection.features.can_return_columns_from_insert)
+        with mock.patch.object(UpnModel, 'save', side_effect=AssertionError('ORM insert used')):
+            self.assert_upsert()
+
+    def test_insert_and_integrity_error_fallback(self):
+        with mock.patch.object(connection.features, 'can_return_columns_from_insert', False), \
+                mock.patch.object(UpnModel, '_insert_on_conflict_do_nothing',
+                                  side_effect=AssertionError('ON CONFLICT used')):
+            self.assert_upsert()
+
+    def test_rnd_collision_retries_with_fresh_rnd(self):
+        taken, _ = upsert()
+        for returning in (True, False):
+            with self.subTest(returning=returning), \
+                    mock.patch.object(connection.features, 'can_return_columns_from_insert', returning), \
+                    mock.patch('apps.qr.models.rnd', side_effect=[taken.rnd, f'fresh{returning:d}']):
+                upn_model, created = upsert(znesek=2.0 + returning)
+                self.assertTrue(created)
+                self.assertEqual(upn_model.rnd, f'fresh{returning:d}')
+
+    def test_rnd_collisions_exhausted(self):
+        taken, _ = upsert()
+        with mock.patch('apps.qr.models.rnd', return_value=taken.rnd), self.assertRaises(IntegrityError):
+            upsert(znesek=3.0)
+
+
+class ImportUpnTest(TestCase):
+    def import_texts(self, *texts) -> str:
+        out = StringIO()
+        with mock.patch('sys.stdin', StringIO(''.join(json.dumps(text) + '\n' for text in texts))):
+            call_command('import_upn', stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    @override_settings(QR_DIGEST_LEGACY_READ=True)
+    def test_content_stored_under_legacy_md5_is_not_imported_again(self):
+        legacy_model, _ = upsert()
+        UpnModel.objects.filter(pk=legacy_model.pk).update(md5=legacy_md5_hash(legacy_model))
+
+        output = self.import_texts(upn_text(), upn_text(znesek=5.0))
+        self.assertIn('2 valid, 1 inserted, 1 duplicates', output)
+        self.assertEqual(UpnModel.objects.count(), 2)
+
+
+class ShortIdTest(TestCase):
+    def test_feistel_permutation_is_a_bijection(self):
+        for length in (1, 2, 3):
+            with self.subTest(length=length):
+                permutation = FeistelPermutation(length, 'key')
+                space = range(16 ** length)
+                permuted = [permutation.permute(n) for n in space]
+                self.assertEqual(sorted(permuted), list(space))
+                self.assertEqual([permutation.invert(n) for n in permuted], list(space))
+
+    def test_feistel_permutation_depends_on_key(self):
+        first, second = FeistelPermutation(3, 'key'), FeistelPermutation(3, 'other key')
+        self.assertNotEqual([first.permute(n) for n in range(64)], [second.permute(n) for n in range(64)])
+        self.assertNotEqual([first.permute(n) for n in range(64)], list(range(64)))
+
+    def test_sequence_ids_do_not_repeat(self):
+        generator = SequenceShortId(3, key='key', block_size=7)
+        ids = generator.allocate(20) + [generator.next_id() for _ in range(30)] + generator.allocate(5)
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertTrue(all(len(rnd_id) == 3 for rnd_id in ids))
+        self.assertEqual(RndSequence.objects.get().value, 20 + 35 + 5)  # 30 next_id in 5 blocks of 7
+
+    @override_settings(QR_RND_GENERATOR='apps.qr.shortid.SequenceShortId', QR_RND_KEY='')
+    def test_sequence_ids_need_own_key(self):
+        self.assertEqual([error.id for error in rnd_key_check(None)], ['qr.E002'])
+        with self.assertRaises(ImproperlyConfigured):
+            SequenceShortId(3)
+        with override_settings(QR_RND_KEY='key'):
+            self.assertEqual(rnd_key_check(None), [])
+
+    def test_rnd_is_allocated_on_insert_only(self):
+        with mock.patch('apps.qr.models.rnd', side_effect=lambda: uuid4().hex[:16]) as allocate:
+            UpnModel()
+            QrManualForm()
+            QrFullForm()
+            services.parse_upn_text(upn_text())
+            self.assertEqual(allocate.call_count, 0)
+            upsert()
+            self.assertEqual(allocate.call_count, 1)
+
+
+class CodecTest(SimpleTestCase):
+    PAYLOAD = UpnPayload(ime_placnika='Marija Špela Čebulj-Koželj', ulica_placnika='Mašera-Spasićeva ulica 1',
+                         kraj_placnika='1000 Ljubljana', znesek=1234.56, koda_namena='GDSV',
+                         namen_placila='Račun 04/2026 ŽĐŠČĆ', rok_placila=date(2026, 4, 17),
+                         iban_prejemnika='SI56051008010486080', referenca='SI121033842574531',
+                         ime_prejemnika='Občina Šmarje pri Jelšah', ulica_prejemnika='Aškerčev trg 12',
+                         kraj_prejemnika='3240 Šmarje pri Jelšah')
+
+    def test_upn_round_trip_through_iso_8859_2(self):
+        text = encode_upn(self.PAYLOAD)
+        self.assertTrue(text.endswith('\n'))
+        decoded = decode_upn(text.encode('iso-8859-2').decode('iso-8859-2'))
+        self.assertTrue(decoded.checksum_ok)
+        self.assertEqual(replace(decoded, kontrolna_vsota=''), self.PAYLOAD)
+        self.assertEqual(encode_upn(decoded), text)
+
+    def test_upn_decode_tolerates_crlf_and_extra_fields(self):
+        text = encode_upn(self.PAYLOAD).replace('\n', '\r\n') + 'EMAIL:info@example.com\r\n'
+        self.assertEqual(decode_upn(text), decode_upn(encode_upn(self.PAYLOAD)))
+
+    def test_upn_decode_errors(self):
+        fields = encode_upn(self.PAYLOAD).split('\n')
+        for message, text in (('Not a UPN QR code', 'BCD\n002'),
+                              ('Wrong list length', '\n'.join(fields[:15])),
+                              ('Invalid amount', '\n'.join(fields[:8] + ['12,34'] + fields[9:])),
+                              ('Invalid amount', '\n'.join(fields[:8] + ['１２３４'] + fields[9:])),
+                              ('Invalid rok_placila', '\n'.join(fields[:13] + ['31.02.2026'] + fields[14:]))):
+            with self.subTest(text=text), self.assertRaisesMessage(CodecError, message):
+                decode_upn(text)
+
+    def test_epc_matches_segno(self):
+        payload = epc_from_upn(self.PAYLOAD)
+        expected = _make_epc_qr_data(payload.name, payload.iban, payload.amount, text=payload.text,
+                                     encoding='utf-8').decode('utf-8')
+        self.assertEqual(encode_epc(payload), expected)
+        self.assertEqual(decode_epc(encode_epc(payload)), payload)
+
+    def test_epc_matches_segno_with_bic_purpose_and_charset(self):
+        payload = replace(epc_from_upn(self.PAYLOAD), bic='LJBASI2X', purpose='GDSV', charset=3)
+        expected = _make_epc_qr_data(payload.name, payload.iban, payload.amount, text=payload.text, bic=payload.bic,
+                                     purpose=payload.purpose, encoding='iso-8859-2').decode('iso-8859-2')
+        self.assertEqual(encode_epc(payload), expected)
+
+    def test_epc_minimum_amount(self):
+        self.assertEqual(epc_from_upn(replace(self.PAYLOAD, znesek=0)).amount, 0.01)
+
+    def test_epc_encode_errors(self):
+        valid = EpcPayload(name='Snaga d.o.o.', iban='SI56051008010486080', amount=14.71, text='SI12 1033842574531')
+        for message, payload in (('Invalid name', replace(valid, name='')),
+                                 ('Invalid name', replace(valid, name='x' * 71)),
+                                 ('Invalid IBAN', replace(valid, iban='SI56')),
+                                 ('Invalid amount', replace(valid, amount=0)),
+                                 ('Invalid amount', replace(valid, amount=1e9)),
+                                 ('Either a text or a creditor reference', replace(valid, reference='RF18539007547034')),
+                                 ('Either a text or a creditor reference', replace(valid, text='')),
+                                 ('BIC is required', replace(valid, version='001')),
+                                 ('Invalid EPC version', replace(valid, version='003')),
+                                 ('Remittance information is too long', replace(valid, text='x' * 141)),
+                                 ('Invalid BIC', replace(valid, bic='LJBASI2')),
+                                 ('Invalid purpose', replace(valid, purpose='OTHRX')),
+                                 ('Invalid character set', replace(valid, charset=9)),
+                                 ('does not fit character set', replace(valid, name='Čebulj', charset=2)),
+                                 ('Payload is too big', replace(valid, text='Ž' * 140, name='Š' * 70))):
+            with self.subTest(payload=payload), self.assertRaisesMessage(CodecError, message):
+                encode_epc(payload)
+
+    def test_epc_decode_errors(self):
+        for message, text in (('Not an EPC QR code', 'UPNQR\n'),
+                              ('Invalid EPC version', 'BCD\n003\n1\nSCT\n\nName\nSI56051008010486080\nEUR1\n\n'),
+                              ('Invalid amount', 'BCD\n002\n1\nSCT\n\nName\nSI56051008010486080\nEUR1,5\n\n'),
+                              ('Invalid character set', 'BCD\n002\nx\nSCT\n\nName\nSI56051008010486080\n\n\n')):
+            with self.subTest(text=text), self.assertRaisesMessage(CodecError, message):
+                decode_epc(text)
+
+
+@override_settings(ALLOWED_HOSTS=['upn-epc-qr.si', 'qr.example.com'])
+class ScanFragmentCacheTest(TestCase):
+    def tearDown(self):
+        scan_cache.clear()
+
+    def scan(self, host: str, secure: bool = False):
+        return self.client.post('/api/v1/qr/', {'decodedText': upn_text(), 'result': '{"scan": 1}'},
+                                HTTP_HX_REQUEST='true', HTTP_HOST=host, secure=secure)
+
+    def test_share_link_follows_scheme_and_host(self):
+        local_hits = scan_cache.stats()['local_hits']
+        for host, secure in (('upn-epc-qr.si', True), ('qr.example.com', False), ('upn-epc-qr.si', True)):
+            with self.subTest(host=host, secure=secure):
+                response = self.scan(host, secure)
+                self.assertEqual(response.status_code, 200)
+                rnd_id = UpnModel.objects.get().rnd
+                scheme = 'https' if secure else 'http'
+                self.assertContains(response, f'value="{scheme}://{host}/qr/{rnd_id}/"')
+        self.assertEqual(scan_cache.stats()['local_hits'] - local_hits, 1)  # only the repeat on the same host
+
+
+@skipUnless(os.environ.get('UPN_BENCH'), 'timing benchmark, run with UPN_BENCH=1')
+class ParseBenchmarkTest(SimpleTestCase):
+    """
+    manage.py bench_parse: legacy vs current check_iso_8859_2 and per-record UpnBaseModel.from_list cost.
+    Only speedup ratios within one run are checked, still too noisy for a loaded CI box - skipped by default.
+    """
+
+    def test_parse_speedup_holds(self):
+        out = StringIO()
+        try:
+            call_command('bench_parse', number=2000, stdout=out)
+        except CommandError as e:
+            self.fail(f'{e}\n{out.getvalue()}')
+
+
+class SearchIndexTest(TestCase):
+    def triggers(self) -> set:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'qr_upnmodel'")
+            return {row[0] for row in cursor.fetchall()}
+
+    def test_post_migrate_restores_dropped_triggers(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('FTS5 search index is SQLite only')
+        with connection.cursor() as cursor:  # what a table rebuild does
+            for name in self.triggers():
+                cursor.execute(f'DROP TRIGGER {name}')
+        upsert(ime_prejemnika='Komunalno podjetje Ptuj d.d.')
+
+        install_search_index()
+        self.assertEqual(self.triggers(), {f'{FTS_TABLE}_ai', f'{FTS_TABLE}_ad', f'{FTS_TABLE}_au'})
+        self.assertEqual(search_upn(UpnModel.objects.all(), 'Ptuj').count(), 1)  # row written without triggers
+        upsert(ime_prejemnika='Elektro Ljubljana d.d.')
+        self.assertEqual(search_upn(UpnModel.objects.all(), 'Elektro').count(), 1)
+
+
+class BrokenExecutor:
+    """ProcessPoolExecutor whose workers die in the initializer"""
+    instances = 0
+
+    def __init__(self, *args, **kwargs):
+        BrokenExecutor.instances += 1
+        self.shut_down = False
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_exception(BrokenProcessPool('A child process terminated abruptly'))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+@override_settings(QR_RENDER_FARM_WORKERS=2)
+class RenderFarmTest(SimpleTestCase):
+    def test_failed_warm_up_is_not_kept(self):
+        farm = RenderFarm()
+        BrokenExecutor.instances = 0
+        with mock.patch('apps.qr.farm.ProcessPoolExecutor', BrokenExecutor):
+            for attempt in (1, 2):
+                with self.assertRaises(RenderFarmError):
+                    farm.run(max, 1, 2)
+                self.assertIsNone(farm._executor)
+                self.assertEqual(BrokenExecutor.instances, attempt)  # every call starts a fresh pool
+
+
+class MetricsTest(SimpleTestCase):
+    def test_endpoint_is_off_by_default(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        with override_settings(QR_METRICS=True):
+            response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'upn_stage_seconds', response.content)
+
+    def test_collector_is_registered_once(self):
+        self.assertIs(collector(Counter, 'upn_dedupe', 'second import', ['result']), DEDUPE_TOTAL)
@@ -2,23 +2,58 @@
 __author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
 
 import re
+import unicodedata
 from datetime import datetime
+from functools import lru_cache
 from pydantic import BaseModel, Field, field_validator
 
 
+# Common characters from phone keyboards / PDF copy-paste which ISO-8859-2 does not have
+ISO_8859_2_TRANSLITERATION = {
+    '‘': "'", '’': "'", '‚': "'", '‛': "'", '′': "'",
+    '“': '"', '”': '"', '„': '"', '‟': '"', '″': '"', '«': '"', '»': '"',
+    '‐': '-', '‑': '-', '‒': '-', '–': '-', '—': '-', '―': '-', '−': '-',
+    '…': '...', '€': 'EUR', '•': '*', '·': '.', '\u2009': ' ', '\u202f': ' ', '\u200b': '',
+}
+
+
+class Iso88592Table(dict):
+    """
+    str.translate table: every ISO-8859-2 character maps to itself, C1 controls (128-159) to '_',
+    anything else is transliterated once (explicit map, then accent stripping, then '_') and remembered.
+    """
+
+    def __init__(self):
+        super().__init__({ord(char): char for char in bytes(range(256)).decode('iso-8859-2')})
+        self.update({code: '_' for code in range(128, 160)})
+        self.update({ord(char): value for char, value in ISO_8859_2_TRANSLITERATION.items()})
+
+    def __missing__(self, code):
+        decomposed = unicodedata.normalize('NFKD', chr(code))
+        value = ''.join(char for char in decomposed if ord(char) in self and not unicodedata.combining(char))
+        self[code] = value = value.translate(self) or '_'
+        return value
+
+
+ISO_8859_2_TABLE = Iso88592Table()
+
+
+# Any character the table would change: not in ISO-8859-2, or a C1 control
+NOT_ISO_8859_2_RE = re.compile('[^' + re.escape(''.join(
+    char for char in bytes(range(256)).decode('iso-8859-2') if not 128 <= ord(char) < 160)) + ']')
+
+
 def check_iso_8859_2(data: str):
-    out = ''
-    for char in [ord(char) for char in data]:
-        if char in range(128, 159):
-            char = 95
-        out += chr(char)
-    return out
+    # Common cases skip the per-character table: ASCII, or clean ISO-8859-2 text (one C regex scan)
+    if data.isascii() or not NOT_ISO_8859_2_RE.search(data):
+        return data
+    return data.translate(ISO_8859_2_TABLE)
 
 
 class ListBaseModel(BaseModel):
     @classmethod
     def from_list(cls, tpl):
-        return cls(**{k: v for k, v in zip(cls.__fields__.keys(), tpl)})
+        return cls(**{k: v for k, v in zip(cls.model_fields.keys(), tpl)})
 
 
 class UpnBaseModel(ListBaseModel):
@@ -106,3 +141,66 @@ class UpnBaseModel(ListBaseModel):
         """Truncate to 42 chars and clean ISO-8859-2"""
         cleaned = check_iso_8859_2(v)
         return cleaned[:42] if len(cleaned) > 42 else cleaned
+
+
+UPN_DATE_RE = re.compile(r'(\d{1,2})\.(\d{1,2})\.(\d{4})')
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)  # deadlines repeat a lot (monthly bills), datetime is immutable
+def parse_upn_date(value: str) -> datetime | None:
+    """DD.MM.YYYY (ASCII digits, whitespace ignored) -> datetime at noon, as UpnBaseModel.parse_datum_placila"""
+    if len(value) == 10 and value[2] == '.' and value[5] == '.':
+        day, month, year = value[:2], value[3:5], value[6:]
+    else:
+        match = UPN_DATE_RE.fullmatch(WHITESPACE_RE.sub('', value))
+        if not match:
+            return None
+        day, month, year = match.groups()
+    if not (value.isascii() and day.isdigit() and month.isdigit() and year.isdigit()):
+        return None
+    try:
+        return datetime(int(year), int(month), int(day), 12)
+    except ValueError:
+        return None
+
+
+def parse_upn_list(fields: list) -> dict | None:
+    """
+    Fast path of UpnBaseModel: 20 UPN fields -> UpnModel kwargs, same as UpnBaseModel.from_list(...).model_dump()
+    for well-formed input. None when a field is not in its canonical form - UpnBaseModel then gives the detailed
+    error (or accepts it).
+    """
+    if len(fields) != 20 or fields[0] != 'UPNQR':
+        return None
+
+    amount = fields[8]
+    if not (amount.isascii() and amount.isdigit()):
+        return None
+
+    deadline = fields[13]
+    if deadline:
+        deadline = parse_upn_date(deadline)
+        if deadline is None:
+            return None
+
+    # One sanitizer pass for all text fields, LF is kept by the table
+    (ime_placnika, ulica_placnika, kraj_placnika, namen_placila, ime_prejemnika, ulica_prejemnika,
+     kraj_prejemnika) = check_iso_8859_2('\n'.join((fields[5], fields[6], fields[7], fields[12], fields[16],
+                                                     fields[17], fields[18]))).split('\n')
+    referenca = fields[15]
+    return {
+        'ime_placnika': ime_placnika[:45],
+        'ulica_placnika': ulica_placnika[:45],
+        'kraj_placnika': kraj_placnika[:45],
+        'znesek': int(amount) / 100 or 0.01,
+        'koda_namena': fields[11],
+        'namen_placila': namen_placila[:42],
+        'rok_placila': deadline,
+        'iban_prejemnika': fields[14],
+        'referenca': f'{referenca[:4]} {referenca[4:]}',
+        'ime_prejemnika': ime_prejemnika[:42],
+        'ulica_prejemnika': ulica_prejemnika[:33],
+        'kraj_prejemnika': kraj_prejemnika[:33],
+        'kontrolna_vsota': fields[19],
+    }
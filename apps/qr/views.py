@@ -2,45 +2,96 @@
 
 __author__ = 'Nikolay Mamashin (mamashin@gmail.com)'
 
-import base64
+import hashlib
 import json
 import re
+from datetime import datetime
 import sentry_sdk
-from django.http import HttpResponse, Http404
-from django.shortcuts import render, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, Http404
+from django.shortcuts import render
+from django.urls import reverse
 from django.views import View
 from django.views.decorators.http import require_GET
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.utils.translation import get_language
 from django.views.generic import CreateView, TemplateView, ListView, DetailView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from decouple import config  # noqa
 from django.db.models.expressions import F
 from loguru import logger
-from result import Result, is_ok, is_err
+from result import Result, Err, is_ok, is_err
 from django import forms
 from django.shortcuts import render
-from django_htmx.http import retarget, push_url
+from django_htmx.http import retarget, push_url, trigger_client_event
 from urllib.parse import quote
 
-from .epc import generate_qr_code
+from .cache import TieredCache
+from .epc import (DEFAULT_IMAGE_PROFILE, IMAGE_PROFILES, ImageProfile, generate_qr_image, generate_qr_png,
+                  peek_qr_image, qr_image_etag)
+from .executor import RenderPoolFull, render_pool
 from .forms import QrForm, QrManualForm, QrFullForm
 from .services import create_upn_model
 from .models import UpnModel
 from .pdf_generator import UpnPdfGenerator
+from .records import EpcRecord, PdfRecord
+from .tasks import PENDING_STATUSES, enqueue_pdf_job, get_rendered_pdf, pdf_job_key, pdf_job_status
+
+
+scan_cache = TieredCache(prefix='upn-scan:v2',
+                         max_size=settings.QR_SCAN_CACHE_SIZE,
+                         alias=settings.QR_RENDER_CACHE_ALIAS,
+                         timeout=settings.QR_SCAN_CACHE_TIMEOUT)
+
+
+def _scan_cache_key(request) -> str:
+    """Raw decodedText digest + language (the fragment is translated) + scheme and host (in the share link)"""
+    digest = hashlib.blake2b(request.POST.get("decodedText", "").encode('utf-8'), digest_size=16).hexdigest()
+    return f'{digest}:{get_language()}:{request.scheme}://{request.get_host()}'
+
+
+def _render_pool_full(e: RenderPoolFull) -> HttpResponse:
+    """Load shedding answer of the async views, clients retry shortly instead of waiting in a queue"""
+    logger.warning(f'Request shed - {e}')
+    response = HttpResponse("Server is busy, please try again", status=503)
+    response['Retry-After'] = '1'
+    return response
 
 
 class PostQr(TemplateView):
+    """Async: DB work through sync_to_async, the EPC render check on render_pool"""
     template_name = "main.html"
 
-    def post(self, request, *args, **kwargs):
+    async def get(self, request, *args, **kwargs):
+        return render(request, self.template_name, self.get_context_data(**kwargs))
+
+    async def post(self, request, *args, **kwargs):
         if request.htmx:
-            create_result = create_upn_model(request.POST)
+            # Repeat scan of the same text: rnd and fragment straight from the cache
+            key = _scan_cache_key(request)
+            cached = await scan_cache.aget(key)
+            if cached is not None:
+                rnd_id, content = cached
+                return push_url(HttpResponse(content), f"/qr/{rnd_id}/")
+
+            create_result = await sync_to_async(create_upn_model)(request.POST, render=False)
             if is_ok(create_result):
-                self.extra_context = {"img": create_result.value["img"],
-                                      "model": create_result.value["model"],
+                # Render once here to surface EPC errors, the page loads the image by URL (from render cache)
+                try:
+                    qr_img = await render_pool.run(generate_qr_png, EpcRecord.from_obj(create_result.value["model"]))
+                except RenderPoolFull as e:
+                    return _render_pool_full(e)
+                if is_err(qr_img):
+                    create_result = Err(f'Error generate QR code - {qr_img.err_value}')
+            if is_ok(create_result):
+                self.extra_context = {"model": create_result.value["model"],
                                       "mode": "qr",
                                       "amount_was_auto_set": create_result.value.get("amount_was_auto_set", False)}
-                return push_url(render(request, "qr_ok.html", self.get_context_data()),
-                                f"/qr/{create_result.value['model'].rnd}/")
+                response = render(request, "qr_ok.html", self.get_context_data())
+                await scan_cache.aset(key, (create_result.value['model'].rnd, response.content))
+                return push_url(response, f"/qr/{create_result.value['model'].rnd}/")
             else:
                 logger.error(f'Error create_upn_model: {create_result.err}')
                 with sentry_sdk.new_scope() as scope:
@@ -95,20 +146,21 @@ class PostManualForm(TemplateView):
                         model.data_type = "form_full"
                     else:
                         model.data_type = "form"
-                    model.save()
+                    model, _ = UpnModel.get_or_create_by_content(model)
                 else:
                     model = FormClass(request.POST, instance=model).save(commit=False)
                     model.data_type = "qr_edit"
                     model.save()
-                qr_img = generate_qr_code(model)
+                    if model.md5 != model.md5_sum:  # save() skipped a duplicate, show the existing record
+                        model = UpnModel.objects.filter(md5__in=model.md5_candidates()).first() or model
+                qr_img = generate_qr_png(model)
                 if is_err(qr_img):
                     logger.error(f'Error generate_qr_code: {qr_img.err}')
                     result = render(request, "qr_error.html", {"qr_create_error": qr_img.err})
                     return retarget(result, '#main')
 
                 result = render(request, "qr_ok.html",
-                                {"mode": "qr", "show_form": False, "form": form, 'model': model,
-                                 'img': qr_img.value})
+                                {"mode": "qr", "show_form": False, "form": form, 'model': model})
                 return push_url(retarget(result, '#main'), f"/qr/{model.rnd}/")
             else:  # Not valid form
                 # Return only_form.html with errors
@@ -126,29 +178,85 @@ class PostManualForm(TemplateView):
 class GetSaveQr(TemplateView):
     template_name = "qr_open.html"
 
-    def get(self, request, *args, **kwargs):
-        img, mode, show_form = "", "", False  # Initial values
-        exist_model = UpnModel.objects.filter(rnd=kwargs.get("rnd_id")).first()
+    async def get(self, request, *args, **kwargs):
+        mode, show_form = "", False  # Initial values
+        exist_model = await UpnModel.objects.for_epc().filter(rnd=kwargs.get("rnd_id")).afirst()
         if exist_model:
-            img = generate_qr_code(exist_model)
-            mode = "qr"
-            if is_err(img):
-                exist_model, mode, show_form = None, None, True
-            else:
-                img = img.value
+            mode = "qr"  # QR image itself is loaded by the browser from qr_image URL
         response = render(request,
                           self.template_name,
-                          {"mode": mode, "show_form": show_form, "model": exist_model, "img": img,
+                          {"mode": mode, "show_form": show_form, "model": exist_model,
                            "direct_get": True})
         return response
 
 
+def _pdf_response(pdf_bytes, filename) -> HttpResponse:
+    # Create response with proper Content-Disposition header for non-ASCII filenames
+    # Use RFC 2231/5987 encoding: filename (ASCII fallback) + filename* (UTF-8)
+    response = HttpResponse(pdf_bytes, content_type='application/pdf')
+
+    # ASCII fallback - remove non-ASCII characters
+    ascii_filename = filename.encode('ascii', 'ignore').decode('ascii')
+
+    # UTF-8 encoded filename
+    encoded_filename = quote(filename)
+
+    # Set both filename (ASCII fallback) and filename* (UTF-8)
+    response['Content-Disposition'] = f'attachment; filename="{ascii_filename}"; filename*=UTF-8\'\'{encoded_filename}'
+    return response
+
+
+def _pdf_job_pending(key) -> HttpResponse:
+    """202 with poll URL (Location header, JSON body and HX-Trigger event for HTMX clients)"""
+    poll_url = reverse('qr_pdf_job', args=[key])
+    response = JsonResponse({'status': 'queued', 'poll': poll_url}, status=202)
+    response['Location'] = poll_url
+    response['Retry-After'] = '1'
+    return trigger_client_event(response, 'pdfQueued', {'poll': poll_url})
+
+
+def _pdf_async_response(upn_models, position, draw_template, filename) -> HttpResponse:
+    """Render PDF in RQ worker instead of this request, ready PDF is returned directly"""
+    key = pdf_job_key(upn_models, position, draw_template)
+    rendered = get_rendered_pdf(key)
+    if rendered:
+        return _pdf_response(rendered['pdf'], rendered['filename'])
+    enqueue_pdf_job(upn_models, position, draw_template, filename)
+    return _pdf_job_pending(key)
+
+
+def _pdf_async_requested(request) -> bool:
+    return settings.QR_PDF_ASYNC and request.GET.get('async') == '1'
+
+
+class PdfJobView(View):
+    """Poll URL of the async PDF job: 202 while rendering, PDF when ready, 410 once job and PDF are gone"""
+
+    def get(self, request, job_key, **kwargs):
+        rendered = get_rendered_pdf(job_key)
+        if rendered:
+            return _pdf_response(rendered['pdf'], rendered['filename'])
+        status = pdf_job_status(job_key)
+        if status == 'failed':
+            logger.error(f'PDF job failed: {job_key}')
+            return HttpResponse("Error generating PDF", status=500)
+        if status not in PENDING_STATUSES:
+            # Unknown key, expired failure record or finished job whose PDF left the cache
+            logger.warning(f'PDF job gone: {job_key}, status {status}')
+            return HttpResponse("PDF job not found or expired, request the PDF again", status=410)
+        return _pdf_job_pending(job_key)
+
+
+def _render_pdf(record: PdfRecord, position: str, draw_template: bool) -> bytes:
+    return UpnPdfGenerator(position=position, draw_template=draw_template).generate(record)
+
+
 class DownloadPdfView(TemplateView):
-    """View for downloading UPN QR document as PDF"""
+    """View for downloading UPN QR document as PDF (async, fpdf runs on render_pool)"""
 
-    def get(self, request, *args, **kwargs):
+    async def get(self, request, *args, **kwargs):
         rnd_id = kwargs.get("rnd_id")
-        upn_model = UpnModel.objects.filter(rnd=rnd_id).first()
+        upn_model = await UpnModel.objects.for_pdf().filter(rnd=rnd_id).afirst()
 
         if not upn_model:
             logger.error(f'PDF download: Model not found for rnd={rnd_id}')
@@ -170,50 +278,134 @@ class DownloadPdfView(TemplateView):
 
             logger.info(f'PDF download settings: position={position}, draw_template={draw_template}')
 
+            if _pdf_async_requested(request):
+                return await sync_to_async(_pdf_async_response)([upn_model], position, draw_template,
+                                                                UpnPdfGenerator.generate_filename(upn_model))
+
             # Generate PDF with custom settings
-            generator = UpnPdfGenerator(position=position, draw_template=draw_template)
-            pdf_bytes = generator.generate(upn_model)
+            record = PdfRecord.from_obj(upn_model)
+            pdf_bytes = await render_pool.run(_render_pdf, record, position, draw_template)
 
             # Generate filename
-            filename = UpnPdfGenerator.generate_filename(upn_model)
+            filename = UpnPdfGenerator.generate_filename(record)
+            response = _pdf_response(pdf_bytes, filename)
 
-            # Create response with proper Content-Disposition header for non-ASCII filenames
-            # Use RFC 2231/5987 encoding: filename (ASCII fallback) + filename* (UTF-8)
-            response = HttpResponse(pdf_bytes, content_type='application/pdf')
+            logger.info(f'PDF generated successfully for rnd={rnd_id}, filename={filename}')
+            return response
 
-            # ASCII fallback - remove non-ASCII characters
-            ascii_filename = filename.encode('ascii', 'ignore').decode('ascii')
+        except RenderPoolFull as e:
+            return _render_pool_full(e)
+        except Exception as e:
+            logger.error(f'Error generating PDF for rnd={rnd_id}: {str(e)}')
+            return HttpResponse(f"Error generating PDF: {str(e)}", status=500)
 
-            # UTF-8 encoded filename
-            encoded_filename = quote(filename)
 
-            # Set both filename (ASCII fallback) and filename* (UTF-8)
-            response['Content-Disposition'] = f'attachment; filename="{ascii_filename}"; filename*=UTF-8\'\'{encoded_filename}'
+class DownloadPdfBatchView(View):
+    """
+    Many UPN QR documents in one PDF, two slips per page.
+    /qr/pdf/batch/?rnd=abc123&rnd=def456 (or ?rnd=abc123,def456), template=0 - without background
+    """
 
-            logger.info(f'PDF generated successfully for rnd={rnd_id}, filename={filename}')
-            return response
+    def get(self, request, *args, **kwargs):
+        rnd_ids = []
+        for value in request.GET.getlist('rnd'):
+            rnd_ids += [rnd_id.strip() for rnd_id in value.split(',') if rnd_id.strip()]
+        rnd_ids = list(dict.fromkeys(rnd_ids))  # dedupe, keep order
+        if not rnd_ids:
+            return HttpResponse("No QR codes requested", status=400)
+        if len(rnd_ids) > settings.QR_PDF_BATCH_MAX_ITEMS:
+            return HttpResponse(f"Max {settings.QR_PDF_BATCH_MAX_ITEMS} QR codes per PDF", status=400)
+
+        # Same rule as DownloadPdfView - no PDF for simple forms
+        upn_models = (UpnModel.objects.for_pdf().filter(rnd__in=rnd_ids).exclude(data_type='form')
+                      .in_bulk(field_name='rnd'))
+        upn_models = [upn_models[rnd_id] for rnd_id in rnd_ids if rnd_id in upn_models]
+        if not upn_models:
+            logger.error(f'PDF batch download: no models found for rnd={rnd_ids}')
+            return HttpResponse("QR codes not found", status=404)
+
+        draw_template = request.GET.get('template', '1') == '1'
+        filename = f'UPN-batch-{len(upn_models)}-{datetime.now().strftime("%d%m%Y")}.pdf'
+        if _pdf_async_requested(request):
+            return _pdf_async_response(upn_models, 'top', draw_template, filename)
 
+        try:
+            pdf_bytes = UpnPdfGenerator(draw_template=draw_template).generate_batch(
+                [PdfRecord.from_obj(upn_model) for upn_model in upn_models])
         except Exception as e:
-            logger.error(f'Error generating PDF for rnd={rnd_id}: {str(e)}')
+            logger.error(f'Error generating batch PDF for rnd={rnd_ids}: {str(e)}')
             return HttpResponse(f"Error generating PDF: {str(e)}", status=500)
 
+        logger.info(f'Batch PDF generated: {len(upn_models)} of {len(rnd_ids)} requested')
+        return _pdf_response(pdf_bytes, filename)
+
 
-def _qr_image_filename(upn_model) -> str:
+def _qr_image_filename(upn_model, profile: ImageProfile) -> str:
     date = upn_model.rok_placila or upn_model.created
     date_str = date.strftime('%Y%m%d')
     amount_str = f'{upn_model.znesek:.2f}'.rstrip('0').rstrip('.')
     recipient = re.sub(r'[^a-z0-9]+', '-', upn_model.ime_prejemnika.lower())[:15].strip('-')
-    return f'epc-qr_{date_str}_{amount_str}_{recipient}.png'
+    return f'epc-qr_{date_str}_{amount_str}_{recipient}.{profile.extension}'
+
+
+def _qr_image_profile(request, inline: bool) -> ImageProfile:
+    """
+    ?format=<profile> wins. Without it <img> requests (inline) take the first profile type listed in Accept,
+    downloads stay PNG - browsers send image/webp in Accept of every navigation as well.
+    """
+    name = request.GET.get('format')
+    if name is not None:
+        if name not in IMAGE_PROFILES:
+            raise Http404
+        return IMAGE_PROFILES[name]
+    if inline:
+        by_type = {profile.content_type: profile for profile in reversed(IMAGE_PROFILES.values())}  # png over print
+        for media_type in request.accepted_types:
+            profile = by_type.get(f'{media_type.main_type}/{media_type.sub_type}')
+            if profile is not None:
+                return profile
+    return DEFAULT_IMAGE_PROFILE
 
 
 class DownloadQrImageView(View):
-    def get(self, request, rnd_id, **kwargs):
-        upn_model = get_object_or_404(UpnModel, rnd=rnd_id)
-        qr_result = generate_qr_code(upn_model)
-        if is_err(qr_result):
+    """
+    Raw image of the EPC QR code, PNG unless another profile is asked for (_qr_image_profile).
+    Async: a render cache hit in this process is answered on the event loop, anything else goes to render_pool.
+    inline=True is the <img src> variant: with ?v=<md5> the URL is content addressed and cached forever,
+    otherwise the browser revalidates with If-None-Match and gets 304 without any rendering.
+    """
+
+    async def get(self, request, rnd_id, inline=False, **kwargs):
+        profile = _qr_image_profile(request, inline)
+        extra = () if inline else ('rok_placila', 'created')  # attachment filename
+        upn_model = await UpnModel.objects.for_epc(*extra).filter(rnd=rnd_id).afirst()
+        if upn_model is None:
             raise Http404
-        img_bytes = base64.b64decode(qr_result.value)
-        filename = _qr_image_filename(upn_model)
-        response = HttpResponse(img_bytes, content_type='image/png')
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        etag = qr_image_etag(upn_model, profile)
+        if request.GET.get('v') == upn_model.md5:
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            cache_control = 'no-cache'
+
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            record = EpcRecord.from_obj(upn_model)
+            image = peek_qr_image(record, profile)
+            if image is None:
+                try:
+                    qr_result = await render_pool.run(generate_qr_image, record, profile)
+                except RenderPoolFull as e:
+                    return _render_pool_full(e)
+                if is_err(qr_result):
+                    raise Http404
+                image = qr_result.value
+            response = HttpResponse(image, content_type=profile.content_type)
+            if not inline:
+                filename = _qr_image_filename(upn_model, profile)
+                response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        if inline:
+            patch_vary_headers(response, ('Accept',))
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
         return response
@@ -7,3 +7,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'conf.settings')
 
 application = get_asgi_application()
+
+# Spawn and warm the render farm before the first request instead of on it
+from django.conf import settings  # noqa: E402
+
+if settings.QR_RENDER_FARM:
+    from apps.qr.farm import render_farm
+    render_farm.start()
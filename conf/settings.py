@@ -31,6 +31,7 @@ INSTALLED_APPS = [
 
     "rest_framework",
     "django_htmx",
+    "django_rq",
 
     "apps.core",
     "apps.users",
@@ -99,12 +100,47 @@ MIDDLEWARE = (
 # Database
 # ------------------------------------------------------------------------------
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+DB_ENGINE = config('DB_ENGINE', default='sqlite')  # sqlite | postgresql
+
+if DB_ENGINE == 'postgresql':
+    # psycopg3 pool per worker process (pip install "psycopg[binary,pool]"), Django needs CONN_MAX_AGE=0 with it
+    DB_POOL = config('DB_POOL', default=True, cast=bool)
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME', default='upn'),
+            'USER': config('DB_USER', default='upn'),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default='localhost'),
+            'PORT': config('DB_PORT', default=5432, cast=int),
+            'CONN_MAX_AGE': 0 if DB_POOL else config('DB_CONN_MAX_AGE', default=60, cast=int),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if DB_POOL:
+        from psycopg_pool import ConnectionPool
+
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+            'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+            'check': ConnectionPool.check_connection,  # health check on checkout
+        }
+else:
+    # WAL lets readers run next to the writer, IMMEDIATE takes the write lock at BEGIN so the busy
+    # timeout applies instead of "database is locked" on lock upgrade
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+            'OPTIONS': {
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': config('DB_SQLITE_TIMEOUT', default=20, cast=int),
+            },
+        }
     }
-}
 
 # Rest Framework
 # ------------------------------------------------------------------------------
@@ -130,6 +166,22 @@ REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': DEFAULT_RENDERER_CLASSES
 }
 
+# UpnModel.md5 holds blake2b content digest, rows created before it keep the legacy MD5 over JSON until
+# `manage.py rehash_upn` rewrites them. While True, duplicate lookups also match the legacy value.
+QR_DIGEST_LEGACY_READ = config('QR_DIGEST_LEGACY_READ', default=True, cast=bool)
+
+# Max UPN payloads in one /api/v1/qr/batch/ request
+QR_BATCH_MAX_ITEMS = config('QR_BATCH_MAX_ITEMS', default=1000, cast=int)
+# Max UPN slips in one /qr/pdf/batch/ document
+QR_PDF_BATCH_MAX_ITEMS = config('QR_PDF_BATCH_MAX_ITEMS', default=200, cast=int)
+# Public short ID (UpnModel.rnd): apps.qr.shortid.RandomShortId or SequenceShortId (DB counter + Feistel
+# permutation, never collides). Switch together with a new QR_RND_LENGTH so old random IDs can not clash.
+QR_RND_GENERATOR = config('QR_RND_GENERATOR', default='apps.qr.shortid.RandomShortId')
+QR_RND_LENGTH = config('QR_RND_LENGTH', default=6, cast=int)
+# SequenceShortId permutation key, required with it (qr.E002). Never change it once IDs are issued.
+QR_RND_KEY = config('QR_RND_KEY', default='')
+QR_RND_BLOCK_SIZE = config('QR_RND_BLOCK_SIZE', default=100, cast=int)  # counters reserved per query
+
 # Templates
 # ------------------------------------------------------------------------------
 
@@ -204,6 +256,48 @@ else:
         }
     }
 
+# Rendered EPC QR images (apps.qr.epc), keyed by UpnModel.md5 + render version.
+# Local LRU tier per process, shared tier only when Redis cache is configured.
+QR_RENDER_CACHE_SIZE = config("QR_RENDER_CACHE_SIZE", default=512, cast=int)
+QR_RENDER_CACHE_ALIAS = "default" if config("REDIS_CACHE_URL", cast=bool, default=False) else None
+QR_RENDER_CACHE_TIMEOUT = config("QR_RENDER_CACHE_TIMEOUT", default=60 * 60 * 24 * 30, cast=int)
+
+# Repeat scans (apps.qr.views.PostQr): digest of raw decodedText + language + scheme/host (share link) -> rnd
+# and rendered qr_ok.html. Short lived, an edited record keeps answering the original text until the entry expires.
+QR_SCAN_CACHE_SIZE = config("QR_SCAN_CACHE_SIZE", default=256, cast=int)
+QR_SCAN_CACHE_TIMEOUT = config("QR_SCAN_CACHE_TIMEOUT", default=60 * 10, cast=int)
+
+
+# RQ (django-rq) - background jobs, run workers with `manage.py rqworker default`
+# ------------------------------------------------------------------------------
+
+RQ_QUEUES = {
+    "default": {
+        "URL": config("REDIS_RQ_URL", default=config("REDIS_CACHE_URL", default="redis://localhost:6379/0")),
+        "DEFAULT_TIMEOUT": 300,
+    },
+}
+
+# PDF rendering in RQ worker (?async=1 on PDF views), rendered PDFs are kept in the default cache,
+# so it needs REDIS_CACHE_URL as well (system check qr.E001)
+QR_PDF_ASYNC = config("QR_PDF_ASYNC", default=False, cast=bool)
+QR_PDF_CACHE_TIMEOUT = config("QR_PDF_CACHE_TIMEOUT", default=60 * 60, cast=int)
+
+# Async views (ASGI, `uvicorn conf.asgi:application`) run segno/PIL/fpdf work on a bounded thread pool
+# (apps.qr.executor): QR_RENDER_WORKERS jobs run, QR_RENDER_QUEUE_SIZE wait, any more are shed with 503.
+QR_RENDER_WORKERS = config("QR_RENDER_WORKERS", default=4, cast=int)
+QR_RENDER_QUEUE_SIZE = config("QR_RENDER_QUEUE_SIZE", default=32, cast=int)
+
+# Render farm (apps.qr.farm): QR images and PDFs rendered in QR_RENDER_FARM_WORKERS warmed processes per
+# web worker instead of the calling thread, QR_RENDER_FARM_TIMEOUT seconds per task.
+QR_RENDER_FARM = config("QR_RENDER_FARM", default=False, cast=bool)
+QR_RENDER_FARM_WORKERS = config("QR_RENDER_FARM_WORKERS", default=2, cast=int)
+QR_RENDER_FARM_TIMEOUT = config("QR_RENDER_FARM_TIMEOUT", default=30, cast=int)
+
+# Prometheus metrics at /metrics (apps.qr.metrics), unauthenticated - off by default, turn on only behind a proxy
+# that keeps /metrics to the scraper. Multiple worker processes also need PROMETHEUS_MULTIPROC_DIR, see README.
+QR_METRICS = config("QR_METRICS", default=False, cast=bool)
+
 
 SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
 